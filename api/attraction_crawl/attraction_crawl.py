@@ -1,214 +1,506 @@
+import argparse
 import asyncio
 import json
-import random
-import string
-from typing import List, TypedDict
+import os
+import sys
 
-import httpx
 from loguru import logger as log
-from bs4 import BeautifulSoup
-import requests
 
+import oxylabs
+import page_cache
+import timing
+from crawl_scheduler import CircuitBreaker, CrawlError, CrawlScheduler, Hedger, PageNotFound
+from extractors import MAX_ATTRACTION, attractions_url, iter_attractions
+from location_cache import LocationCache
+from result_cache import NegativeCache, ResultCache, normalize_state
+from timing import span
+from tripadvisor import make_client, scrape_location_data
 
-class LocationData(TypedDict):
-    """result dataclass for tripadvisor location data"""
+# start HTTP session client with our headers and HTTP2
+client = make_client()
 
-    localizedName: str
-    url: str
-    HOTELS_URL: str
-    ATTRACTIONS_URL: str
-    RESTAURANTS_URL: str
-    placeType: str
-    latitude: float
-    longitude: float
+# Define credentials
+credentials = ('mingmingg', 'Gogogogo1234')
 
+# Separate keep-alive client for the proxy so the worker reuses its connections
+proxy_client = oxylabs.make_proxy_client(credentials)
 
-async def scrape_location_data(query: str, client: httpx.AsyncClient) -> List[LocationData]:
-    """
-    scrape search location data from a given query.
-    e.g. "New York" will return us TripAdvisor's location details for this query
-    """
-    # log.info(f"scraping location data: {query}")
-    # the graphql payload that defines our search
-    # note: that changing values outside of expected ranges can block the web scraper
-    payload = [
-            {
-                "variables": {
-                    "request": {
-                        "query": query,
-                        "limit": 10,
-                        "scope": "WORLDWIDE",
-                        "locale": "en-US",
-                        "scopeGeoId": 1,
-                        "searchCenter": None,
-                        # note: here you can expand to search for differents.
-                        "types": [
-                            "LOCATION",
-                            # "QUERY_SUGGESTION",
-                            # "RESCUE_RESULT"
-                        ],
-                        "locationTypes": [
-                            "GEO",
-                            "AIRPORT",
-                            "ACCOMMODATION",
-                            "ATTRACTION",
-                            "ATTRACTION_PRODUCT",
-                            "EATERY",
-                            "NEIGHBORHOOD",
-                            "AIRLINE",
-                            "SHOPPING",
-                            "UNIVERSITY",
-                            "GENERAL_HOSPITAL",
-                            "PORT",
-                            "FERRY",
-                            "CORPORATION",
-                            "VACATION_RENTAL",
-                            "SHIP",
-                            "CRUISE_LINE",
-                            "CAR_RENTAL_OFFICE",
-                        ],
-                        "userId": None,
-                        "context": {},
-                        "enabledFeatures": ["articles"],
-                        "includeRecent": True,
-                    }
-                },
-                # Every graphql query has a query ID that doesn't change often:
-                "query": "84b17ed122fbdbd4",
-                "extensions": {"preRegisteredQueryId": "84b17ed122fbdbd4"},
-            }
-        ]
-
-    # we need to generate a random request ID for this request to succeed
-    random_request_id = "".join(
-        random.choice(string.ascii_lowercase + string.digits) for i in range(180)
-    )
-    headers = {
-        "X-Requested-By": random_request_id,
-        "Referer": "https://www.tripadvisor.com/Hotels",
-        "Origin": "https://www.tripadvisor.com",
-    }
-    result = await client.post(
-        url="https://www.tripadvisor.com/data/graphql/ids",
-        json=payload,
-        headers=headers,
-    )
-    data = json.loads(result.content)
-    results = data[0]["data"]["Typeahead_autocomplete"]["results"]
-    results = [r['details'] for r in results if 'details' in r] # strip metadata
-    # log.info(f"found {len(results)} results")
-    return results
-
-# To avoid being instantly blocked we'll be using request headers that
-# mimic Chrome browser on Windows
-BASE_HEADERS = {
-    "authority": "www.tripadvisor.com",
-    "accept-language": "en-US,en;q=0.9",
-    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36",
-    "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8",
-    "accept-language": "en-US;en;q=0.9",
-    "accept-encoding": "gzip, deflate, br",
-}
-# start HTTP session client with our headers and HTTP2
-client = httpx.AsyncClient(
-    http2=True,  # http2 connections are significantly less likely to get blocked
-    headers=BASE_HEADERS,
-    timeout=httpx.Timeout(150.0),
-    limits=httpx.Limits(max_connections=5),
-)
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+# shared with prewarm.py, which keeps it filled
+RESULT_CACHE_FILE = os.path.join(CACHE_DIR, "recommendations.json")
+
+# per-state result cache, proxy request hedging, circuit breaker around the
+# proxy and cache of empty or unknown states, configured from the command line in main()
+result_cache = None
+hedger = None
+breaker = None
+negative_cache = None
+
+# typeahead results per state, shared with the data_processing crawlers
+location_cache = LocationCache()
+
+# the typeahead hits tripadvisor.com directly, without the proxy: rate limit it and
+# retry briefly, a request with a deadline is cut off by TYPEAHEAD_SHARE anyway
+typeahead_scheduler = CrawlScheduler(rate=1.0, burst=4, max_per_host=4, max_retries=2, backoff_max=5.0)
+
+# with a deadline, the share of it the typeahead may use before the listing
+# fetch can no longer finish in time, and the seconds kept to write the answer
+TYPEAHEAD_SHARE = 0.3
+DEADLINE_RESERVE = 0.2
+
+# crawls that missed their deadline and keep running to fill the result cache
+background_crawls = set()
 
+# singleflight: normalized state -> the crawl all concurrent requests for it share
+inflight = {}
+crawl_stats = {"crawls": 0, "coalesced": 0}
 
-async def run(query: str):
-    result = await scrape_location_data(query, client)
+
+class UnknownState(CrawlError):
+    """the typeahead has no TripAdvisor location for the query"""
+
+
+async def crawl(query: str, on_item=None, resolved=None) -> list:
+    """
+    return the top attractions of a state in the format printed by run().
+    on_item(attraction) is called for every attraction as soon as it is extracted,
+    the `resolved` event is set once the typeahead answered.
+    """
+    with span("location", query):
+        result = await location_cache.resolve(query, client, scrape_location_data, typeahead_scheduler)
+    if resolved is not None:
+        resolved.set()
     # print(json.dumps(result, indent=2))
-    url = result[0]["ATTRACTIONS_URL"]
-    # print("url before: ", url)
-    index = url.find('Activities-')
-    url = url[:index + len('Activities-')] + 'oa0-' + url[index + len('Activities-'):]
-    url = 'https://www.tripadvisor.com' + url
-    # Define information for POST request
-    payload = {
-        "source": "universal",
-        "url": url,
-        "geo_location": "United States"
-    }
-
-    url = "https://realtime.oxylabs.io/v1/queries"
-
-    # Define credentials
-    credentials = ('mingmingg', 'Gogogogo1234')
-
-    # Send Post Request
-    response = requests.post(url, json=payload, auth=credentials)
-
-    # print("Status code:", response.status_code)
-
-    # print("Response content:", response.text)
-    content = response.json()["results"][0]["content"]
-    # print("content:", content)
-    soup = BeautifulSoup(content, "html.parser")
-    # print("soup:", soup)
-
-    # Limit 15 attraction for each recommendation
-    MAX_ATTRACTION = 15
+    if not result:
+        raise UnknownState(f"no TripAdvisor location found for {query}")
+    try:
+        url = attractions_url(result[0])
+        with span("fetch", query):
+            content = await oxylabs.fetch_page(proxy_client, url, hedger=hedger, breaker=breaker)
+    except PageNotFound:
+        # only a listing that is gone says the cached url is wrong; timeouts, proxy
+        # errors and an open breaker leave the (practically static) location alone
+        location_cache.invalidate(query)
+        raise
     data = []
-    cnt = 0
-    for div in soup.find_all("div", {"class": "ALtqV z", "data-automation": "cardWrapper"}):
-        cnt += 1
-        if cnt >= MAX_ATTRACTION:
-            break
-        name_div = div.find("div", {"class": "XfVdV o AIbhI"})
-        name = ""
-        if name_div:
-            name = name_div.get_text(strip=True)
-            import re
-            def remove_leading_number_dot(s):
-                return re.sub(r'^\d+\.', '', s)
-            name = remove_leading_number_dot(name)
-            
-        rating_tag = div.find('title')
-        rating = 0
-        if rating_tag:
-            tmp_rating = rating_tag.get_text(strip=True)
-            import re
-            match = re.search(r'\d+(\.\d+)?', tmp_rating)
-            rating = match.group()
-
-        attraction_anchor = div.find("a")
-        attraction_link = ""
-        if attraction_anchor:
-            attraction_link = attraction_anchor.get('href')
-
-        tag = div.find("div", {"class": "biGQs _P pZUbB hmDzD"})
-        attraction_tag = ""
-        if tag:
-            attraction_tag = tag.get_text(strip=True)
-            attraction_tag = attraction_tag.replace("\u2022", "and")
-
-        img_tag = div.find('img')
-        img_src = ""
-        if img_tag:
-            img_src = img_tag.get('src')
-
-        data.append({
-            "name": name,
-            "rating": rating,
-            'tag': attraction_tag,
-            "url": attraction_link,
-            'image': img_src,
-            'state': query
-        })
-
-    data_json = json.dumps(data, indent=4)
-    print(data_json)
-    sys.stdout.flush()
+    with span("parse", query) as fields:
+        for attraction in iter_attractions(content, query, limit=MAX_ATTRACTION):
+            data.append(attraction)
+            if on_item:
+                on_item(attraction)
+        fields["attractions"] = len(data)
+    if not data:
+        # the cached listing url may have moved
+        location_cache.invalidate(query)
+    return data
+
+
+class Flight:
+    """
+    one crawl in flight and everybody waiting for it. Stands in for crawl()'s
+    on_item callback and resolved event and forwards both to every caller.
+    """
+
+    def __init__(self):
+        self.items = []
+        self.listeners = []
+        self.events = []
+        self.is_resolved = False
+        self.task = None
+
+    def emit(self, attraction):
+        self.items.append(attraction)
+        for on_item in self.listeners:
+            on_item(attraction)
+
+    def set(self):
+        self.is_resolved = True
+        for event in self.events:
+            event.set()
+
+    def join(self, on_item=None, resolved=None):
+        if on_item:
+            # catch up on what was streamed before this caller joined
+            for attraction in self.items:
+                on_item(attraction)
+            self.listeners.append(on_item)
+        if resolved is not None:
+            if self.is_resolved:
+                resolved.set()
+            self.events.append(resolved)
+
+
+async def checked_crawl(query: str, on_item=None, resolved=None) -> list:
+    """crawl() that skips and records states the negative cache knows are empty or unknown"""
+    if negative_cache is None:
+        return await crawl(query, on_item, resolved)
+    reason = negative_cache.check(query)
+    if reason:
+        raise CrawlError(f"{query} skipped: {reason}")
+    try:
+        data = await crawl(query, on_item, resolved)
+    except UnknownState as e:
+        negative_cache.record_failure(query, str(e))
+        raise
+    # other errors are upstream failures, the circuit breaker's business
+    if data:
+        negative_cache.record_success(query)
+    else:
+        negative_cache.record_failure(query, "no attractions on the listing page")
+    return data
+
+
+async def shared_crawl(query: str, on_item=None, resolved=None) -> list:
+    """checked_crawl(), but concurrent calls for the same normalized state share one crawl"""
+    key = normalize_state(query)
+    flight = inflight.get(key)
+    if flight is None:
+        crawl_stats["crawls"] += 1
+        flight = Flight()
+        flight.task = asyncio.ensure_future(checked_crawl(query, flight.emit, flight))
+        inflight[key] = flight
+        flight.task.add_done_callback(lambda _: inflight.pop(key, None))
+    else:
+        crawl_stats["coalesced"] += 1
+    flight.join(on_item, resolved)
+    # shielded: a caller that stops waiting must not cancel the others' crawl
+    return await asyncio.shield(flight.task)
+
+
+async def recommend(query: str, on_item=None, resolved=None) -> list:
+    """shared_crawl() behind the result cache when one is configured"""
+    if result_cache is None:
+        return await shared_crawl(query, on_item, resolved)
+    crawled = False
+
+    async def crawl_and_emit(query):
+        nonlocal crawled
+        crawled = True
+        return await shared_crawl(query, on_item, resolved)
+
+    data = await result_cache.get(query, shared_crawl, miss_loader=crawl_and_emit)
+    if on_item and not crawled:
+        # served from the cache, emit everything at once
+        for attraction in data:
+            on_item(attraction)
+    return data
+
+
+async def recommend_within(query: str, deadline=None, on_item=None):
+    """
+    recommend() that answers within `deadline` seconds, returns (attractions, partial).
+    The typeahead gets TYPEAHEAD_SHARE of the budget and the listing fetch the rest.
+    When time runs out the attractions parsed so far are returned with partial=True
+    and the crawl goes on in the background, so the next request hits the cache.
+    """
+    if deadline is None:
+        return await recommend(query, on_item), False
+    loop = asyncio.get_running_loop()
+    expires_at = loop.time() + deadline - DEADLINE_RESERVE
+    items = []
+    answered = False
+
+    def emit(attraction):
+        items.append(attraction)
+        if on_item and not answered:
+            on_item(attraction)
+
+    resolved = asyncio.Event()
+    task = asyncio.ensure_future(recommend(query, emit, resolved))
+    waiter = asyncio.ensure_future(resolved.wait())
+    await asyncio.wait([task, waiter], timeout=max(0, deadline * TYPEAHEAD_SHARE),
+                       return_when=asyncio.FIRST_COMPLETED)
+    waiter.cancel()
+    if resolved.is_set() or task.done():
+        await asyncio.wait([task], timeout=max(0, expires_at - loop.time()))
+    if task.done():
+        return task.result(), False
+
+    answered = True
+    stage = "listing fetch" if resolved.is_set() else "typeahead"
+    log.warning(f"{query}: deadline of {deadline}s reached during the {stage}, {len(items)} attractions so far")
+    background_crawls.add(task)
+    task.add_done_callback(background_crawls.discard)
+    # nobody waits for it anymore, retrieve its exception so it is not logged as unhandled
+    task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    return list(items), True
+
+
+async def run(query: str, deadline=None):
+    with span("request", query):
+        data, partial = await recommend_within(query, deadline)
+    if deadline is not None:
+        # only with a deadline the caller has to tell partial answers apart
+        data = {"partial": partial, "recommendations": data}
+    with span("serialize", query):
+        data_json = json.dumps(data, indent=4)
+    with span("write", query):
+        print(data_json)
+        sys.stdout.flush()
 
     # df = pd.DataFrame(data)
     # df.to_csv("search_results.csv", index=False)
 
-import sys
+
+def print_line(message):
+    with span("serialize"):
+        line = json.dumps(message) + "\n"
+    with span("write"):
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+
+async def run_stream(query: str, deadline=None) -> bool:
+    """
+    print one compact JSON line per attraction as soon as it is extracted, then
+    a status line: {"status": "done", "count": n, "partial": bool} or {"status": "error", ...}
+    """
+    count = 0
+
+    def emit(attraction):
+        nonlocal count
+        count += 1
+        print_line(attraction)
+
+    try:
+        _, partial = await recommend_within(query, deadline, on_item=emit)
+    except Exception as e:
+        print_line({"status": "error", "error": str(e), "count": count})
+        return False
+    print_line({"status": "done", "count": count, "partial": partial})
+    return True
+
+
+def read_states_file(filename):
+    """one state per line, from a file or from stdin with "-" """
+    if filename == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(filename, 'r', encoding='utf-8') as file:
+            lines = file.readlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
+async def run_batch(states, deadline=None, stream=False, concurrency=8, max_requeues=1) -> bool:
+    """
+    crawl many states concurrently on the shared clients. Prints a state ->
+    recommendations map, or with `stream` one {"state": ..., "recommendations": ...}
+    line per state as soon as it is done. States without recommendations are
+    retried up to max_requeues times, then reported with an empty list or an
+    {"state": ..., "error": ...} line.
+    """
+    async def crawl_state(state):
+        with span("request", state):
+            data, partial = await recommend_within(state, deadline)
+        if data and stream:
+            print_line({"state": state, "recommendations": data, "partial": partial})
+        return data
+
+    scheduler = CrawlScheduler(max_requeues=max_requeues)
+    results, failed = await scheduler.run_all(states, crawl_state, concurrency=concurrency)
+    if stream:
+        for state in failed:
+            print_line({"state": state, "error": "no recommendations"})
+    else:
+        with span("serialize"):
+            data_json = json.dumps({state: data or [] for state, data in zip(states, results)}, indent=4)
+        with span("write"):
+            print(data_json)
+            sys.stdout.flush()
+    log.info(f"batch: {len(states) - len(failed)}/{len(states)} states crawled")
+    return not failed
+
+
+async def handle_request(line: str, write):
+    """
+    answer one line-delimited JSON request by calling write(response):
+    {"id": ..., "state": ...}, or {"id": ..., "op": "stats"} for the cache, crawl,
+    hedging, circuit breaker and negative cache counters, or {"id": ..., "op": "metrics"}
+    for the latency histograms per stage and per state.
+    With "stream": true every attraction is written as {"id": ..., "item": ...}
+    as soon as it is extracted, followed by {"id": ..., "status": "done", "count": n}.
+    With "deadline": seconds the answer comes in time with "partial": true if the
+    crawl could not finish, see recommend_within().
+    """
+    request_id = None
+    try:
+        request = json.loads(line)
+        request_id = request.get("id")
+        if request.get("op") == "stats":
+            stats = result_cache.snapshot() if result_cache else {}
+            write({"id": request_id, "stats": stats, "crawls": crawl_stats,
+                   "hedging": hedger.stats if hedger else {},
+                   "breaker": breaker.snapshot() if breaker else {},
+                   "negative": negative_cache.snapshot() if negative_cache else {},
+                   "typeahead": dict(typeahead_scheduler.stats)})
+        elif request.get("op") == "metrics":
+            write({"id": request_id, "metrics": timing.metrics.snapshot()})
+        elif request.get("stream"):
+            with span("request", request["state"]):
+                data, partial = await recommend_within(request["state"], request.get("deadline"),
+                                                       on_item=lambda item: write({"id": request_id, "item": item}))
+            write({"id": request_id, "status": "done", "count": len(data), "partial": partial})
+        else:
+            with span("request", request["state"]):
+                data, partial = await recommend_within(request["state"], request.get("deadline"))
+            write({"id": request_id, "recommendations": data, "partial": partial})
+    except Exception as e:
+        log.error(f"crawl failed for request {request_id}: {e!r}")
+        write({"id": request_id, "error": str(e)})
+    timing.write_metrics(force=False)
+
+
+async def serve_stdio():
+    """
+    long-lived worker: read one JSON request per line from stdin and write one
+    JSON response per line to stdout. Requests are handled concurrently so
+    responses can come back out of order; match them by "id".
+    """
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    while True:
+        # readline in a thread so this also works with the Windows event loop
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            break
+        if not line.strip():
+            continue
+        task = asyncio.create_task(handle_request(line, print_line))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+async def serve_socket(host: str, port: int):
+    """same protocol as serve_stdio(), over a local TCP socket"""
+    async def on_connection(reader, writer):
+        tasks = set()
+
+        def write(message):
+            # a single write() per line, so concurrent answers never interleave
+            writer.write((json.dumps(message) + "\n").encode())
+
+        async def answer(line):
+            await handle_request(line, write)
+            await writer.drain()
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            task = asyncio.create_task(answer(line.decode()))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        writer.close()
+
+    server = await asyncio.start_server(on_connection, host, port)
+    log.info(f"crawl worker listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+async def main(args):
+    global result_cache, hedger, breaker, negative_cache
+    exit_code = 0
+    timing.configure(args.timing_log, args.metrics_file)
+    if args.replay:
+        # results of old pages must not reach the caches live requests are answered from
+        page_cache.enable_replay()
+        args.no_cache = True
+        args.negative_after = 0
+    if not args.no_cache:
+        result_cache = ResultCache(path=args.cache_file, ttl=args.cache_ttl, max_entries=args.cache_size)
+    if args.breaker_failures > 0:
+        breaker = CircuitBreaker(failure_threshold=args.breaker_failures, reset_timeout=args.breaker_reset)
+    if args.negative_after > 0:
+        negative_cache = NegativeCache(path=args.negative_file, ttl=args.negative_ttl, threshold=args.negative_after)
+    if args.hedge_after is not None or args.hedge_percentile is not None:
+        hedger = Hedger(delay=args.hedge_after if args.hedge_after is not None else 3.0,
+                        percentile=args.hedge_percentile)
+    try:
+        if args.worker:
+            await serve_stdio()
+        elif args.serve:
+            host, _, port = args.serve.rpartition(":")
+            await serve_socket(host or "127.0.0.1", int(port))
+        elif args.states_file or len(args.state) > 1:
+            states = args.state + (read_states_file(args.states_file) if args.states_file else [])
+            if not await run_batch(states, args.deadline, args.stream, args.max_in_flight, args.max_requeues):
+                exit_code = 1
+        elif args.state and args.stream:
+            if not await run_stream(args.state[0], args.deadline):
+                exit_code = 1
+        elif args.state:
+            await run(args.state[0], args.deadline)
+        # a one-shot run does not outlive its deadline to finish a late crawl
+        for task in background_crawls:
+            task.cancel()
+        if result_cache:
+            await result_cache.wait_for_refreshes()
+            result_cache.flush()
+    finally:
+        await client.aclose()
+        await proxy_client.aclose()
+        timing.write_metrics()
+        if crawl_stats["coalesced"]:
+            log.info(f"crawls: {crawl_stats}")
+        if hedger:
+            log.info(f"hedging: {hedger.stats}, delay {hedger.hedge_delay():.2f}s")
+    return exit_code
+
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        arg1 = sys.argv[1]
-        asyncio.run(run(arg1))
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Crawl top TripAdvisor attractions of a state")
+    parser.add_argument("state", nargs="*",
+                        help="state to crawl, e.g. \"Da Nang\"; several states are crawled as one batch")
+    parser.add_argument("--states-file", metavar="FILE",
+                        help="batch mode: also crawl the states listed one per line in FILE (\"-\" for stdin)")
+    parser.add_argument("--max-in-flight", type=int, default=8,
+                        help="batch mode: maximum number of states crawled at the same time")
+    parser.add_argument("--max-requeues", type=int, default=1,
+                        help="batch mode: how many times states without recommendations are retried")
+    parser.add_argument("--worker", action="store_true",
+                        help="stay alive and answer line-delimited JSON requests on stdin/stdout")
+    parser.add_argument("--serve", metavar="[HOST:]PORT",
+                        help="stay alive and answer line-delimited JSON requests on a local socket")
+    parser.add_argument("--stream", action="store_true",
+                        help="print one JSON line per attraction as soon as it is parsed, then a status line; "
+                             "in batch mode one line per state")
+    parser.add_argument("--deadline", type=float,
+                        help="seconds to answer in, the output gets a \"partial\" flag when the crawl could not finish")
+    parser.add_argument("--hedge-after", type=float,
+                        help="send a second proxy request when the first has not answered after this many seconds")
+    parser.add_argument("--hedge-percentile", type=float,
+                        help="hedge after this percentile of the observed proxy latencies instead "
+                             "(--hedge-after, default 3s, is used until enough requests were timed)")
+    parser.add_argument("--breaker-failures", type=int, default=5,
+                        help="consecutive proxy failures that open the circuit breaker (0 disables it)")
+    parser.add_argument("--breaker-reset", type=float, default=30.0,
+                        help="seconds the open breaker fails fast before one probe request is let through")
+    parser.add_argument("--negative-after", type=int, default=2,
+                        help="failed crawls in a row after which an empty or unknown state is skipped (0 disables)")
+    parser.add_argument("--negative-ttl", type=float, default=6 * 60 * 60,
+                        help="seconds an empty or unknown state is skipped")
+    parser.add_argument("--negative-file", default=os.path.join(CACHE_DIR, "negative.json"),
+                        help="on-disk backing store of the negative cache")
+    parser.add_argument("--timing-log", action="store_true",
+                        help="log a JSON line with the duration of every stage (typeahead, fetch, parse, ...)")
+    parser.add_argument("--metrics-file",
+                        help="keep latency histograms per stage and per state in this JSON file")
+    parser.add_argument("--cache-ttl", type=float, default=24 * 60 * 60,
+                        help="seconds a cached state stays fresh before it is refreshed in the background")
+    parser.add_argument("--cache-size", type=int, default=128,
+                        help="maximum number of states kept in the result cache")
+    parser.add_argument("--cache-file", default=RESULT_CACHE_FILE,
+                        help="on-disk backing store of the result cache")
+    parser.add_argument("--no-cache", action="store_true", help="always crawl, never use the result cache")
+    parser.add_argument("--replay", action="store_true",
+                        help="re-parse pages from the page cache without any network call, "
+                             "implies --no-cache and --negative-after 0")
+    sys.exit(asyncio.run(main(parser.parse_args())))
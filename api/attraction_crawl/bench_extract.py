@@ -0,0 +1,68 @@
+"""
+micro-benchmark of the listing extractors over saved pages, e.g.
+
+    python bench_extract.py attraction page1.html page2.html --repeat 20
+
+compares the old full-page parse with the strained, cut-off parse for every
+available parser and checks that they extract the same cards
+"""
+import argparse
+import importlib.util
+import time
+
+from bs4 import BeautifulSoup
+
+import extractors
+
+LIMITS = {
+    "attraction": extractors.MAX_ATTRACTION,
+    "hotel": extractors.MAX_HOTELS,
+    "restaurant": extractors.MAX_RESTAURANTS,
+}
+CARDS = {
+    "attraction": (extractors.ATTRACTION_CARD, extractors.attraction_card),
+    "hotel": (extractors.HOTEL_CARD, extractors.hotel_card),
+    "restaurant": (extractors.RESTAURANT_CARD, extractors.restaurant_card),
+}
+
+
+def full_parse(entity, content, limit):
+    """what the crawlers did before: build the whole tree, then walk every card"""
+    card_attrs, parse_card = CARDS[entity]
+    cards = BeautifulSoup(content, "html.parser").find_all("div", card_attrs)
+    if limit:
+        cards = cards[:limit - 1]
+    return [parse_card(div, "bench") for div in cards]
+
+
+def timed(fn, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [fn(content) for content in pages]
+    return (time.perf_counter() - start) / (repeat * len(pages)), results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("entity", choices=list(extractors.ENTITIES))
+    parser.add_argument("pages", nargs="+", help="saved listing pages (html)")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--no-limit", action="store_true", help="extract every card, like the gen_* scripts")
+    args = parser.parse_args()
+
+    pages = []
+    for filename in args.pages:
+        with open(filename, 'r', encoding='utf-8') as file:
+            pages.append(file.read())
+    limit = None if args.no_limit else LIMITS[args.entity]
+    extract = extractors.ENTITIES[args.entity].extract
+
+    baseline, expected = timed(lambda content: full_parse(args.entity, content, limit), pages, args.repeat)
+    print(f"{'full html.parser':<24} {baseline * 1000:9.2f} ms/page")
+    for backend in ["html.parser", "lxml"]:
+        if backend == "lxml" and importlib.util.find_spec("lxml") is None:
+            continue
+        elapsed, results = timed(lambda content: extract(content, "bench", limit=limit, parser=backend),
+                                 pages, args.repeat)
+        status = "identical" if results == expected else "DIFFERENT OUTPUT"
+        print(f"{'strained ' + backend:<24} {elapsed * 1000:9.2f} ms/page  x{baseline / elapsed:5.1f}  {status}")
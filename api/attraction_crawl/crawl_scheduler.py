@@ -0,0 +1,266 @@
+import asyncio
+import random
+import time
+from collections import defaultdict, deque
+from urllib.parse import urlsplit
+
+import httpx
+from loguru import logger as log
+
+
+class CrawlError(Exception):
+    """a request still failed after every retry"""
+
+
+class CircuitOpen(CrawlError):
+    """the circuit breaker is open, the request was not sent"""
+
+
+class PageNotFound(CrawlError):
+    """the page behind the proxy answered 404, its url is wrong rather than the upstream down"""
+
+
+class TokenBucket:
+    """allow `rate` requests per second on average with bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CrawlScheduler:
+    """
+    shared request policy for the crawl scripts: a token bucket and a concurrency
+    limit per upstream host, retries with exponential backoff and jitter on
+    non-200 responses and timeouts, and run_all() which requeues failed jobs.
+    """
+
+    def __init__(self, rate=2.0, burst=None, max_per_host=8, max_retries=4,
+                 backoff_base=1.0, backoff_max=30.0, max_requeues=2):
+        self.rate = rate
+        self.burst = burst
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_requeues = max_requeues
+        self.buckets = {}
+        self.host_limits = {}
+        self.stats = defaultdict(int)
+
+    def bucket(self, host):
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        return self.buckets[host]
+
+    def host_limit(self, host):
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return self.host_limits[host]
+
+    def backoff(self, attempt):
+        # "full jitter": spread retries so blocked workers don't come back in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def request(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+        """send a request under the host's rate and concurrency limits, retrying failures"""
+        host = urlsplit(url).netloc
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                delay = self.backoff(attempt - 1)
+                retry_after = getattr(error, "retry_after", None)
+                if retry_after:
+                    delay = max(delay, retry_after)
+                await asyncio.sleep(delay)
+            await self.bucket(host).acquire()
+            async with self.host_limit(host):
+                self.stats["requests"] += 1
+                try:
+                    response = await client.request(method, url, **kwargs)
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    error = e
+                    log.warning(f"{method} {url} attempt {attempt + 1}: {e!r}")
+                    continue
+            if response.status_code == 200:
+                return response
+            error = CrawlError(f"{method} {url} returned {response.status_code}")
+            retry_after = response.headers.get("retry-after", "")
+            error.retry_after = float(retry_after) if retry_after.isdigit() else None
+            log.warning(f"{method} {url} attempt {attempt + 1}: status {response.status_code}")
+        self.stats["failures"] += 1
+        raise CrawlError(f"{method} {url} failed after {self.max_retries + 1} attempts: {error}")
+
+    async def run_all(self, items, job, concurrency=8):
+        """
+        run `await job(item)` for every item, at most `concurrency` at a time.
+        A job fails if it raises or returns a falsy value; failed items are put
+        back at the end of the queue up to max_requeues times.
+        Returns (results in item order with None for failures, failed items).
+        """
+        results = [None] * len(items)
+        pending = list(range(len(items)))
+        limit = asyncio.Semaphore(concurrency)
+
+        async def attempt(index):
+            async with limit:
+                try:
+                    result = await job(items[index])
+                except Exception as e:
+                    log.error(f"{items[index]} failed: {e!r}")
+                    return index, None
+            return index, result
+
+        for requeue in range(self.max_requeues + 1):
+            if not pending:
+                break
+            if requeue:
+                self.stats["requeues"] += len(pending)
+                log.info(f"requeueing {len(pending)} failed items (round {requeue})")
+            failed = []
+            for index, result in await asyncio.gather(*[attempt(index) for index in pending]):
+                if result:
+                    results[index] = result
+                else:
+                    failed.append(index)
+            pending = failed
+        return results, [items[index] for index in pending]
+
+
+class Hedger:
+    """
+    hedged requests against tail latency: when the first attempt has not answered
+    after the hedge delay, an identical second one is sent, the first success wins
+    and the other is cancelled. The delay is the `percentile` of the latencies
+    seen so far, or `delay` seconds until `min_samples` were recorded.
+    """
+
+    def __init__(self, delay=3.0, percentile=None, window=200, min_samples=20):
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.stats = {"requests": 0, "hedges": 0, "hedge_wins": 0}
+
+    def hedge_delay(self):
+        if self.percentile is None or len(self.latencies) < self.min_samples:
+            return self.delay
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))]
+
+    async def timed(self, attempt):
+        start = time.monotonic()
+        result = await attempt()
+        self.latencies.append(time.monotonic() - start)
+        return result
+
+    async def run(self, attempt):
+        """`await attempt()`, hedged; attempt is called again for the second request"""
+        self.stats["requests"] += 1
+        start = time.monotonic()
+        # only the first attempt is sampled: a hedge's latency starts late and would
+        # pull the percentile down, which hedges more, which pulls it down further
+        primary = asyncio.ensure_future(self.timed(attempt))
+        try:
+            done, _ = await asyncio.wait([primary], timeout=self.hedge_delay())
+        except asyncio.CancelledError:
+            # asyncio.wait leaves its tasks running, do not keep paying for the request
+            primary.cancel()
+            raise
+        if done:
+            return primary.result()
+
+        self.stats["hedges"] += 1
+        hedge = asyncio.ensure_future(attempt())
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            if primary in pending:
+                # cancelled while still running, it would have taken at least this long
+                self.latencies.append(time.monotonic() - start)
+            for task in pending:
+                task.cancel()
+
+
+class CircuitBreaker:
+    """
+    fail fast while an upstream is down: after `failure_threshold` consecutive
+    failures every call is rejected with CircuitOpen for `reset_timeout` seconds,
+    then a single probe is let through and its success closes the breaker again
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.stats = {"opened": 0, "rejected": 0, "probes": 0}
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def open(self):
+        if self.opened_at is None:
+            self.stats["opened"] += 1
+            log.warning(f"circuit breaker opened after {self.failures} failures")
+        self.opened_at = time.monotonic()
+
+    async def call(self, attempt):
+        """`await attempt()` unless the breaker is open"""
+        probe = False
+        if self.opened_at is not None:
+            if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                self.stats["rejected"] += 1
+                raise CircuitOpen(f"upstream failed {self.failures} times in a row, retrying in "
+                                  f"{max(0.0, self.opened_at + self.reset_timeout - time.monotonic()):.0f}s")
+            probe = self.probing = True
+            self.stats["probes"] += 1
+        try:
+            result = await attempt()
+        except Exception:
+            self.failures += 1
+            if probe or self.failures >= self.failure_threshold:
+                self.open()
+            raise
+        finally:
+            if probe:
+                self.probing = False
+        if self.opened_at is not None:
+            log.info("circuit breaker closed")
+        self.failures = 0
+        self.opened_at = None
+        return result
+
+    def snapshot(self):
+        return dict(self.stats, state=self.state, failures=self.failures)
@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import json
+import os
+
+from loguru import logger as log
+
+import oxylabs
+import page_cache
+import timing
+from crawl_scheduler import CrawlScheduler, PageNotFound
+from extractors import ENTITIES, is_valid_listing
+from location_cache import LocationCache, read_states
+from timing import span
+from tripadvisor import make_client, scrape_location_data
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_processing")
+OUTPUTS = {
+    "attraction": os.path.join(DATA_DIR, "attractions", "attractions.json"),
+    "hotel": os.path.join(DATA_DIR, "hotels+restaurants", "hotels.json"),
+    "restaurant": os.path.join(DATA_DIR, "hotels+restaurants", "restaurants.json"),
+}
+
+# Định nghĩa thông tin xác thực (Basic Auth)
+DEFAULT_CREDENTIALS = ('mingming', 'Gogogogo1234')
+
+
+class EntityCrawler:
+    """
+    crawl the listing pages of several entities (attraction, hotel, restaurant)
+    for many states. Each state is resolved once through the typeahead and its
+    listing pages are fetched concurrently.
+    """
+
+    def __init__(self, entities, credentials=DEFAULT_CREDENTIALS, scheduler=None, location_cache=None):
+        self.entities = [ENTITIES[name] for name in entities]
+        self.client = make_client()
+        self.proxy_client = oxylabs.make_proxy_client(credentials)
+        self.scheduler = scheduler or CrawlScheduler()
+        self.location_cache = location_cache or LocationCache()
+        # entity name -> state -> extracted cards
+        self.results = {entity.name: {} for entity in self.entities}
+
+    async def crawl_entity(self, entity, query, location):
+        url = entity.listing_url(location)
+        print("URL: " + url)
+        with span("fetch", query, entity=entity.name):
+            content = await oxylabs.fetch_page(self.proxy_client, url, self.scheduler)
+        with span("parse", query, entity=entity.name) as fields:
+            data = entity.extract(content, query)
+            fields["cards"] = len(data)
+        return data
+
+    async def crawl_state(self, query) -> bool:
+        """crawl every entity of a state that is still missing, True once all of them succeeded"""
+        result = await self.location_cache.resolve(query, self.client, scrape_location_data, self.scheduler)
+        missing = [entity for entity in self.entities if query not in self.results[entity.name]]
+        outcomes = await asyncio.gather(
+            *[self.crawl_entity(entity, query, result[0]) for entity in missing],
+            return_exceptions=True,
+        )
+        ok = True
+        for entity, data in zip(missing, outcomes):
+            if isinstance(data, Exception) or len(data) == 0:
+                log.error(f"{query} {entity.name}: {data!r}")
+                # only an empty listing or a 404 says the cached url moved, a timeout
+                # or proxy error after every retry keeps the location for the requeue
+                if isinstance(data, PageNotFound) or not isinstance(data, Exception):
+                    self.location_cache.invalidate(query)
+                ok = False
+            elif not is_valid_listing(data):
+                log.error(f"{query} {entity.name}: cards without images")
+                ok = False
+            else:
+                self.results[entity.name][query] = data
+        return ok
+
+    async def run(self, states, concurrency=8):
+        try:
+            await self.scheduler.run_all(states, self.crawl_state, concurrency=concurrency)
+            log.info(f"scheduler: {dict(self.scheduler.stats)}")
+        finally:
+            # Be sure to close the clients
+            await self.client.aclose()
+            await self.proxy_client.aclose()
+
+    def records(self, entity_name, states):
+        """extracted cards of an entity in state order"""
+        return [item for state in states for item in self.results[entity_name].get(state, [])]
+
+    def failed_states(self, entity_name, states):
+        return [state for state in states if state not in self.results[entity_name]]
+
+
+def append_to_txt_file(string_list, filename):
+    with open(filename, 'a', encoding='utf-8') as file:
+        for item in string_list:
+            file.write(f"{item}\n")
+
+
+# JSON
+def read_json_file(filename):
+    try:
+        with open(filename, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return []
+    except json.JSONDecodeError:
+        return []
+
+
+def append_to_json_file(new_data, filename):
+    data = read_json_file(filename)
+    for i in new_data:
+        data.append(i)
+    with open(filename, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False, indent=4)
+
+
+def read_list_from_txt_file(filename):
+    with open(filename, 'r', encoding='utf-8') as file:
+        lines = file.readlines()
+        lines = [line.strip() for line in lines]
+    return [line for line in lines if line]
+
+
+def main(entities=None, credentials=DEFAULT_CREDENTIALS, outputs=OUTPUTS):
+    """
+    command line entry point shared by gen_attraction, gen_hotels, gen_restaurants
+    and this module. Cards are appended to each entity's output json and states
+    that still failed after requeueing to error_states.txt next to it.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("states", nargs="*", help="states to crawl, defaults to every province in states.json")
+    parser.add_argument("--states-file", help="read the states to crawl from a file, e.g. error_states.txt")
+    if entities is None:
+        parser.add_argument("--entities", nargs="+", choices=list(ENTITIES), default=list(ENTITIES),
+                            help="which listings to crawl for every state")
+    parser.add_argument("--max-in-flight", type=int, default=8,
+                        help="maximum number of provinces crawled at the same time")
+    parser.add_argument("--rate", type=float, default=2.0, help="proxy requests per second")
+    parser.add_argument("--max-retries", type=int, default=4, help="retries per proxy request")
+    parser.add_argument("--max-requeues", type=int, default=2,
+                        help="how many times failed provinces are retried at the end of the run")
+    parser.add_argument("--replay", action="store_true",
+                        help="re-extract from the page cache without any network call")
+    parser.add_argument("--timing-log", action="store_true", help="log a JSON line with the duration of every stage")
+    parser.add_argument("--metrics-file", help="write latency histograms per stage and per state to this JSON file")
+    args = parser.parse_args()
+    timing.configure(args.timing_log, args.metrics_file)
+    if args.replay:
+        page_cache.enable_replay()
+    if entities is None:
+        entities = args.entities
+
+    if args.states_file:
+        states = read_list_from_txt_file(args.states_file)
+    elif args.states:
+        states = args.states
+    else:
+        states = read_states()
+
+    scheduler = CrawlScheduler(rate=args.rate, max_per_host=args.max_in_flight,
+                               max_retries=args.max_retries, max_requeues=args.max_requeues)
+    crawler = EntityCrawler(entities, credentials, scheduler)
+    asyncio.run(crawler.run(states, concurrency=args.max_in_flight))
+
+    for name in entities:
+        output = outputs[name]
+        failed = crawler.failed_states(name, states)
+        append_to_txt_file(failed, os.path.join(os.path.dirname(output), 'error_states.txt'))
+        with span("write_output", entity=name):
+            append_to_json_file(crawler.records(name, states), output)
+        print(f"{output}: {len(states) - len(failed)}/{len(states)} states crawled")
+    timing.write_metrics()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import importlib.util
+import os
+import re
+from typing import Callable, Iterator, List, NamedTuple
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from tripadvisor import BASE_URL, LocationData
+
+# Like the original crawlers, parsing stops when the `limit`-th card is reached,
+# so at most limit - 1 cards are returned
+MAX_ATTRACTION = 15
+MAX_HOTELS = 5
+MAX_RESTAURANTS = 5
+
+# html.parser is the reference parser. CRAWL_HTML_PARSER=lxml switches to the
+# faster lxml backend when it is installed.
+HTML_PARSER = os.environ.get("CRAWL_HTML_PARSER", "html.parser")
+if HTML_PARSER == "lxml" and importlib.util.find_spec("lxml") is None:
+    HTML_PARSER = "html.parser"
+
+LEADING_NUMBER_DOT = re.compile(r'^\d+\.')
+RATING = re.compile(r'\d+(\.\d+)?')
+
+ATTRACTION_CARD = {"class": "ALtqV z", "data-automation": "cardWrapper"}
+HOTEL_CARD = {"class": "qeraN _T qMONr iOIte iJfMg ndRxi rcibp FKwyn"}
+RESTAURANT_CARD = {"class": "qeraN _T qMONr iOIte iJfMg ndRxi CpYrl rcibp FKwyn"}
+
+
+def remove_leading_number_dot(s):
+    return LEADING_NUMBER_DOT.sub('', s)
+
+
+def parse_rating(text):
+    match = RATING.search(text)
+    return match.group()
+
+
+def card_pattern(card_attrs):
+    """regex matching the opening <div> tag of a card, whatever the attribute order"""
+    lookaheads = "".join(
+        f'(?=[^>]*\\s{re.escape(name)}="{re.escape(value)}")' for name, value in card_attrs.items()
+    )
+    return re.compile(f'<div{lookaheads}[^>]*>')
+
+
+CARD_PATTERNS = {}
+
+
+def cut_at_card(content, card_attrs, limit):
+    """drop everything from the `limit`-th card on, it would never be extracted"""
+    key = tuple(card_attrs.items())
+    if key not in CARD_PATTERNS:
+        CARD_PATTERNS[key] = card_pattern(card_attrs)
+    for count, match in enumerate(CARD_PATTERNS[key].finditer(content), start=1):
+        if count >= limit:
+            return content[:match.start()]
+    return content
+
+
+def parse_cards(content, card_attrs, limit=None, parser=None):
+    """
+    parse only the card <div>s of a listing page, and nothing past the
+    `limit`-th card, instead of building the tree of the whole page
+    """
+    strainer = SoupStrainer("div", attrs=card_attrs)
+
+    def strained(html):
+        soup = BeautifulSoup(html, parser or HTML_PARSER, parse_only=strainer)
+        return soup.find_all("div", card_attrs)
+
+    if not limit:
+        return strained(content)
+    cut = cut_at_card(content, card_attrs, limit)
+    cards = strained(cut)
+    if len(cards) < limit - 1 and len(cut) < len(content):
+        # the regex also counts card markup the parser skips, e.g. inside a <script>
+        # or a comment, so the cut may have dropped real cards: parse it all
+        cards = strained(content)
+    return cards[:limit - 1]
+
+
+def attractions_url(location: LocationData) -> str:
+    url = location["ATTRACTIONS_URL"]
+    index = url.find('Activities-')
+    url = url[:index + len('Activities-')] + 'oa0-' + url[index + len('Activities-'):]
+    return BASE_URL + url
+
+
+def hotels_url(location: LocationData) -> str:
+    return BASE_URL + location["HOTELS_URL"]
+
+
+def restaurants_url(location: LocationData) -> str:
+    return BASE_URL + location["RESTAURANTS_URL"]
+
+
+def attraction_card(div, query):
+    name_div = div.find("div", {"class": "XfVdV o AIbhI"})
+    name = ""
+    if name_div:
+        name = remove_leading_number_dot(name_div.get_text(strip=True))
+
+    rating_tag = div.find('title')
+    rating = 0
+    if rating_tag:
+        rating = parse_rating(rating_tag.get_text(strip=True))
+
+    attraction_anchor = div.find("a")
+    attraction_link = ""
+    if attraction_anchor:
+        attraction_link = attraction_anchor.get('href')
+
+    tag = div.find("div", {"class": "biGQs _P pZUbB hmDzD"})
+    attraction_tag = ""
+    if tag:
+        attraction_tag = tag.get_text(strip=True)
+        attraction_tag = attraction_tag.replace("\u2022", "and")
+
+    img_tag = div.find('img')
+    img_src = ""
+    if img_tag:
+        img_src = img_tag.get('src')
+
+    return {
+        "name": name,
+        "rating": rating,
+        'tag': attraction_tag,
+        "url": attraction_link,
+        'image': img_src,
+        'state': query
+    }
+
+
+def listing_card(div, query, name_class, rating_class=None):
+    """
+    hotel and restaurant cards only differ by their css classes. The rating is
+    read from the aria-label of `rating_class`, or from the card's <title>.
+    """
+    name_div = div.find("div", {"class": name_class})
+    name = ""
+    if name_div:
+        name = remove_leading_number_dot(name_div.get_text(strip=True))
+
+    rating = 0
+    if rating_class:
+        rating_tag = div.find("div", {"class": rating_class})
+        if rating_tag:
+            rating = parse_rating(rating_tag.get('aria-label'))
+    else:
+        rating_tag = div.find('title')
+        if rating_tag:
+            rating = parse_rating(rating_tag.get_text(strip=True))
+
+    anchor = div.find("a")
+    link = ""
+    if anchor:
+        link = anchor.get('href')
+
+    img_tag = div.find('img')
+    img_src = ""
+    if img_tag:
+        img_src = img_tag.get('src')
+
+    return {
+        "name": name,
+        "rating": rating,
+        "url": 'tripadvisor.com' + link,
+        'image': img_src,
+        'state': query
+    }
+
+
+def hotel_card(div, query):
+    return listing_card(div, query, name_class="nBrpc o W", rating_class="luFhX o W f u w JSdbl")
+
+
+def restaurant_card(div, query):
+    return listing_card(div, query, name_class="biGQs _P fiohW alXOW NwcxK GzNcM ytVPx UTQMg RnEEZ ngXxk")
+
+
+def iter_attractions(content: str, query: str, limit: int = None, parser: str = None) -> Iterator[dict]:
+    """extract_attractions() one card at a time, for callers that stream results"""
+    for div in parse_cards(content, ATTRACTION_CARD, limit, parser):
+        yield attraction_card(div, query)
+
+
+def extract_attractions(content: str, query: str, limit: int = None, parser: str = None) -> List[dict]:
+    return list(iter_attractions(content, query, limit, parser))
+
+
+def extract_hotels(content: str, query: str, limit: int = MAX_HOTELS, parser: str = None) -> List[dict]:
+    return [hotel_card(div, query) for div in parse_cards(content, HOTEL_CARD, limit, parser)]
+
+
+def extract_restaurants(content: str, query: str, limit: int = MAX_RESTAURANTS, parser: str = None) -> List[dict]:
+    return [restaurant_card(div, query) for div in parse_cards(content, RESTAURANT_CARD, limit, parser)]
+
+
+def is_valid_listing(data: List[dict]) -> bool:
+    """a page without cards, or whose cards have no image at all, is treated as a failed crawl"""
+    return len(data) > 0 and any(item['image'] for item in data)
+
+
+class Entity(NamedTuple):
+    """how to find and parse the listing page of one kind of place"""
+
+    name: str
+    listing_url: Callable[[LocationData], str]
+    extract: Callable[..., List[dict]]
+
+
+ENTITIES = {
+    "attraction": Entity("attraction", attractions_url, extract_attractions),
+    "hotel": Entity("hotel", hotels_url, extract_hotels),
+    "restaurant": Entity("restaurant", restaurants_url, extract_restaurants),
+}
@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import json
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # windows, saves are not locked against other processes
+    fcntl = None
+
+from loguru import logger as log
+
+import page_cache
+from crawl_scheduler import CrawlScheduler
+from result_cache import normalize_state
+from tripadvisor import make_client, scrape_location_data
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+DEFAULT_PATH = os.path.join(CACHE_DIR, "locations.json")
+STATES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_processing", "states+cities", "states.json")
+
+
+class LocationCache:
+    """
+    persistent cache of scrape_location_data() results keyed by query.
+    TripAdvisor geo urls (ATTRACTIONS_URL, HOTELS_URL, RESTAURANTS_URL) hardly ever
+    change, so an entry is kept until a fetch that used it fails.
+
+    The file is shared by attraction_crawl.py, prewarm.py and the gen_* scripts:
+    every save applies its one change to the latest file, so nobody drops
+    locations another process resolved.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.locations = {}
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        self.load()
+
+    def read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            log.warning(f"ignoring corrupt location cache {self.path}")
+            return {}
+
+    def load(self):
+        self.locations = self.read()
+
+    @contextmanager
+    def locked(self):
+        """hold the lock file while reading, merging and replacing the cache file"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def save(self, key, result=None):
+        """
+        write one resolved (or, without result, invalidated) key on top of the
+        latest file, picking up what other processes saved in the meantime.
+        Replay mode never writes, old pages must not change what live crawls use
+        """
+        if page_cache.REPLAY:
+            return
+        # one temp file per process, several processes save at the same time
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with self.locked():
+                locations = self.read()
+                if result:
+                    locations[key] = result
+                else:
+                    locations.pop(key, None)
+                self.locations = locations
+                with open(tmp_path, 'w', encoding='utf-8') as file:
+                    json.dump(self.locations, file, ensure_ascii=False, indent=4)
+                os.replace(tmp_path, self.path)
+        except OSError as e:
+            # the cache only saves typeahead calls, never fail a crawl over it
+            log.warning(f"could not save location cache {self.path}: {e!r}")
+
+    async def resolve(self, query, client, scrape_location_data, scheduler=None):
+        """cached `await scrape_location_data(query, client, scheduler)`"""
+        key = normalize_state(query)
+        if key in self.locations:
+            self.stats["hits"] += 1
+            return self.locations[key]
+        self.stats["misses"] += 1
+        result = await scrape_location_data(query, client, scheduler)
+        if result:
+            self.locations[key] = result
+            self.save(key, result)
+        return result
+
+    def invalidate(self, query):
+        """drop a query whose urls led to a failed fetch so the next crawl resolves it again"""
+        if page_cache.REPLAY:
+            # a page missing from the store says nothing about the url
+            return
+        key = normalize_state(query)
+        if self.locations.pop(key, None) is not None:
+            self.stats["invalidations"] += 1
+            self.save(key)
+
+
+def read_states(filename=STATES_FILE):
+    with open(filename, 'r', encoding='utf-8') as file:
+        return [state["state"] for state in json.load(file)]
+
+
+async def preload(cache, states, force=False):
+    """resolve every state once so later crawls skip the typeahead call"""
+    client = make_client()
+    scheduler = CrawlScheduler()
+    if force:
+        for state in states:
+            cache.locations.pop(normalize_state(state), None)
+    failed = []
+
+    async def resolve(state):
+        try:
+            if not await cache.resolve(state, client, scrape_location_data, scheduler):
+                failed.append(state)
+        except Exception as e:
+            log.error(f"could not resolve {state}: {e!r}")
+            failed.append(state)
+
+    try:
+        await asyncio.gather(*[resolve(state) for state in states])
+    finally:
+        await client.aclose()
+    log.info(f"resolved {len(states) - len(failed)}/{len(states)} states, {cache.stats['misses']} typeahead calls")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the TripAdvisor location cache")
+    parser.add_argument("--preload", action="store_true", help="resolve every province in states.json")
+    parser.add_argument("--force", action="store_true", help="re-resolve provinces that are already cached")
+    parser.add_argument("--states-file", default=STATES_FILE)
+    parser.add_argument("--cache-file", default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    cache = LocationCache(args.cache_file)
+    if args.preload:
+        failed = asyncio.run(preload(cache, read_states(args.states_file), force=args.force))
+        for state in failed:
+            print(state)
+    else:
+        print(json.dumps(sorted(cache.locations), indent=4))
@@ -0,0 +1,56 @@
+import httpx
+
+import page_cache
+from crawl_scheduler import PageNotFound
+
+# Oxylabs realtime endpoint used to fetch tripadvisor pages through a proxy
+PROXY_URL = "https://realtime.oxylabs.io/v1/queries"
+
+
+def make_proxy_client(credentials, max_connections=20, timeout=150.0) -> httpx.AsyncClient:
+    """keep-alive client for the proxy, share one per process so connections are reused"""
+    return httpx.AsyncClient(
+        auth=credentials,
+        timeout=httpx.Timeout(timeout),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+    )
+
+
+async def fetch_page(proxy_client: httpx.AsyncClient, url: str, scheduler=None, hedger=None, breaker=None) -> str:
+    """
+    fetch a tripadvisor page through the oxylabs proxy and return its html.
+    With a CrawlScheduler the request is rate limited and retried, with a Hedger
+    a slow request is raced against a second identical one, with a CircuitBreaker
+    it fails right away while the proxy keeps failing. A 404 of the page raises
+    PageNotFound.
+    Every page is stored in the page cache, and replayed from it in replay mode.
+    """
+    # Define information for POST request
+    payload = {
+        "source": "universal",
+        "url": url,
+        "geo_location": "United States"
+    }
+
+    async def post():
+        if scheduler is not None:
+            response = await scheduler.request(proxy_client, "POST", PROXY_URL, json=payload)
+        else:
+            response = await proxy_client.post(PROXY_URL, json=payload)
+        result = response.json()["results"][0]
+        # status of the tripadvisor page itself, the proxy answers 200 either way
+        if result.get("status_code") == 404:
+            raise PageNotFound(f"{url} returned 404")
+        return result["content"]
+
+    async def hedged():
+        if hedger is not None:
+            return await hedger.run(post)
+        return await post()
+
+    async def fetch():
+        if breaker is not None:
+            return await breaker.call(hedged)
+        return await hedged()
+
+    return await page_cache.cached_fetch(url, fetch)
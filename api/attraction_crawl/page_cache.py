@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import datetime
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger as log
+
+from crawl_scheduler import CrawlError
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+# CRAWL_PAGE_CACHE=<dir> moves the page store, CRAWL_PAGE_CACHE=off disables it
+PAGE_CACHE_DIR = os.environ.get("CRAWL_PAGE_CACHE", os.path.join(CACHE_DIR, "pages"))
+
+# CRAWL_REPLAY=1 (or --replay) serves every fetch from the page store, without network.
+# CRAWL_REPLAY_DATE=YYYY-MM-DD replays the pages fetched on that day instead of the latest ones.
+REPLAY = os.environ.get("CRAWL_REPLAY") == "1"
+REPLAY_DATE = os.environ.get("CRAWL_REPLAY_DATE")
+
+# CRAWL_PAGE_CACHE_DAYS=<n> drops stored pages older than n days, except the latest page of every url
+RETENTION_DAYS = float(os.environ.get("CRAWL_PAGE_CACHE_DAYS", 14))
+
+# gzip level of stored pages: level 9 costs several times the cpu for a few percent of disk
+COMPRESS_LEVEL = 1
+
+
+class PageNotCached(CrawlError):
+    """replay mode asked for a page that was never stored"""
+
+
+class PageCache:
+    """
+    raw page bodies stored gzip-compressed under their sha256, so identical
+    pages are kept once, plus a sqlite index of (url, fetch date) -> digest.
+    Objects no row points to any more are deleted, and rows older than
+    `retention_days` are pruned at most every PRUNE_INTERVAL seconds.
+    """
+
+    PRUNE_INTERVAL = 60 * 60
+
+    # objects this young may belong to a row another process is about to insert
+    GRACE_PERIOD = 60 * 60
+
+    def __init__(self, root=PAGE_CACHE_DIR, retention_days=RETENTION_DAYS):
+        self.root = root
+        self.retention_days = retention_days
+        self.pruned_at = 0
+        # puts run on a writer thread, see cached_fetch()
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT NOT NULL, fetched_on TEXT NOT NULL, fetched_at REAL NOT NULL,"
+            " digest TEXT NOT NULL, size INTEGER NOT NULL, PRIMARY KEY (url, fetched_on))"
+        )
+        self.db.commit()
+
+    def object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest + ".gz")
+
+    def put(self, url, body: str, fetched_at=None):
+        fetched_at = fetched_at or time.time()
+        data = body.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, 'wb', compresslevel=COMPRESS_LEVEL) as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        fetched_on = datetime.date.fromtimestamp(fetched_at).isoformat()
+        with self.lock:
+            # a refresh on the same day replaces the row, its old object may now be unreferenced
+            row = self.db.execute(
+                "SELECT digest FROM pages WHERE url = ? AND fetched_on = ?", (url, fetched_on)
+            ).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                (url, fetched_on, fetched_at, digest, len(data)),
+            )
+            self.db.commit()
+            if row and row[0] != digest:
+                self.delete_unreferenced([row[0]])
+            if time.time() - self.pruned_at > self.PRUNE_INTERVAL:
+                self.prune()
+        return digest
+
+    def delete_unreferenced(self, digests):
+        for digest in digests:
+            if self.db.execute("SELECT 1 FROM pages WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None:
+                try:
+                    os.remove(self.object_path(digest))
+                except FileNotFoundError:
+                    pass
+
+    def prune(self):
+        """drop rows past the retention, keeping the latest row of every url, and their objects"""
+        self.pruned_at = time.time()
+        cutoff = self.pruned_at - self.retention_days * 24 * 60 * 60
+        self.db.execute(
+            "DELETE FROM pages WHERE fetched_at < ? AND fetched_at < "
+            "(SELECT MAX(fetched_at) FROM pages AS latest WHERE latest.url = pages.url)",
+            (cutoff,),
+        )
+        self.db.commit()
+        referenced = {digest for digest, in self.db.execute("SELECT DISTINCT digest FROM pages")}
+        removed = 0
+        for directory, _, files in os.walk(os.path.join(self.root, "objects")):
+            for name in files:
+                path = os.path.join(directory, name)
+                if name.split(".")[0] in referenced:
+                    continue
+                try:
+                    if time.time() - os.path.getmtime(path) > self.GRACE_PERIOD:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        if removed:
+            log.info(f"page cache: removed {removed} unreferenced pages")
+
+    def get(self, url, on=None):
+        """latest stored body of url, or the one fetched on date `on` (YYYY-MM-DD)"""
+        with self.lock:
+            if on:
+                row = self.db.execute(
+                    "SELECT digest FROM pages WHERE url = ? AND fetched_on = ?", (url, on)
+                ).fetchone()
+            else:
+                row = self.db.execute(
+                    "SELECT digest FROM pages WHERE url = ? ORDER BY fetched_at DESC LIMIT 1", (url,)
+                ).fetchone()
+        if row is None:
+            return None
+        try:
+            with gzip.open(self.object_path(row[0]), 'rb') as file:
+                return file.read().decode('utf-8')
+        except FileNotFoundError:
+            # pruned by another process in the meantime
+            return None
+
+    def stats(self):
+        pages, urls, size = self.db.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT url), COALESCE(SUM(size), 0) FROM pages"
+        ).fetchone()
+        objects = 0
+        stored = 0
+        for directory, _, files in os.walk(os.path.join(self.root, "objects")):
+            for name in files:
+                objects += 1
+                stored += os.path.getsize(os.path.join(directory, name))
+        return {"pages": pages, "urls": urls, "objects": objects, "raw_bytes": size, "stored_bytes": stored}
+
+
+store = None
+
+# one thread writes pages so compression and sqlite commits stay off the event loop
+writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-cache")
+
+
+def get_store():
+    """the process-wide page store, None when it is disabled"""
+    global store
+    if store is None and PAGE_CACHE_DIR != "off":
+        store = PageCache(PAGE_CACHE_DIR)
+    return store
+
+
+async def cached_fetch(url, fetch):
+    """
+    `await fetch()` and keep its body in the page store, or in replay mode
+    return the stored body of url without calling fetch at all
+    """
+    if REPLAY:
+        body = get_store().get(url, REPLAY_DATE) if get_store() else None
+        if body is None:
+            raise PageNotCached(f"{url} is not in the page cache")
+        return body
+    body = await fetch()
+    if get_store():
+        # not awaited, the caller does not wait for the page to hit the disk
+        future = asyncio.get_running_loop().run_in_executor(writer, get_store().put, url, body)
+        future.add_done_callback(log_put_error)
+    return body
+
+
+def log_put_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        log.warning(f"could not store page: {future.exception()!r}")
+
+
+def enable_replay(date=None):
+    global REPLAY, REPLAY_DATE
+    REPLAY = True
+    REPLAY_DATE = date or REPLAY_DATE
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the raw page cache")
+    parser.add_argument("urls", nargs="*", help="print the stored versions of these urls")
+    parser.add_argument("--prune", action="store_true",
+                        help=f"drop pages older than CRAWL_PAGE_CACHE_DAYS ({RETENTION_DAYS:g}) now")
+    args = parser.parse_args()
+
+    cache = PageCache()
+    if args.prune:
+        cache.prune()
+    if not args.urls:
+        print(cache.stats())
+    for url in args.urls:
+        for fetched_on, digest, size in cache.db.execute(
+            "SELECT fetched_on, digest, size FROM pages WHERE url = ? ORDER BY fetched_at", (url,)
+        ):
+            print(f"{fetched_on} {digest} {size} bytes  {url}")
@@ -0,0 +1,128 @@
+"""
+keep the recommendations of every province fresh in the shared result cache,
+so the live worker answers from it instead of waiting on the network, e.g.
+
+    python prewarm.py                # run forever
+    python prewarm.py --once         # refresh every province once, for cron
+
+provinces are refreshed one after the other on a staggered schedule; the more
+often a province is requested (counted by the live worker in the cache file)
+the shorter its refresh interval
+"""
+import argparse
+import asyncio
+import heapq
+import random
+import sys
+import time
+
+from loguru import logger as log
+
+import attraction_crawl
+from location_cache import STATES_FILE, read_states
+from result_cache import ResultCache, normalize_state
+
+
+def refresh_intervals(states, counts, period, min_interval):
+    """seconds between two refreshes of every state, shorter for often requested ones"""
+    weights = [1 + counts.get(normalize_state(state), 0) for state in states]
+    mean = sum(weights) / len(weights)
+    return {
+        state: min(period, max(min_interval, period * mean / weight))
+        for state, weight in zip(states, weights)
+    }
+
+
+def initial_schedule(states, cache, intervals, stagger, once=False):
+    """
+    (due time, state) heap: cached states are due when their entry gets old,
+    and no two states start within stagger / len(states) seconds of each other.
+    With `once` every state is due right away, --max-in-flight paces them
+    """
+    now = time.time()
+    if once:
+        stagger = 0
+    queue = []
+    for index, state in enumerate(states):
+        entry = None if once else cache.entries.get(normalize_state(state))
+        due = entry["fetched_at"] + intervals[state] if entry else now
+        heapq.heappush(queue, (max(due, now + stagger * index / len(states)), state))
+    return queue
+
+
+async def prewarm(states, cache, period, min_interval, stagger, concurrency=2, once=False):
+    intervals = refresh_intervals(states, cache.request_counts(), period, min_interval)
+    queue = initial_schedule(states, cache, intervals, stagger, once)
+    limit = asyncio.Semaphore(concurrency)
+    running = set()
+    stats = {"refreshed": 0, "failed": 0}
+
+    async def refresh(state):
+        nonlocal intervals
+        async with limit:
+            try:
+                data = await attraction_crawl.crawl(state)
+            except Exception as e:
+                log.error(f"{state}: {e!r}")
+                data = []
+        if data:
+            cache.put(normalize_state(state), data)
+            stats["refreshed"] += 1
+        else:
+            stats["failed"] += 1
+        if once:
+            return
+        # pick up the latest request counts of the live worker
+        cache.reload_if_changed()
+        intervals = refresh_intervals(states, cache.request_counts(), period, min_interval)
+        interval = intervals[state] if data else min_interval
+        # a little jitter so states refreshed together drift apart
+        heapq.heappush(queue, (time.time() + interval * random.uniform(0.9, 1.1), state))
+        log.info(f"{state}: {len(data)} attractions, next refresh in {interval / 60:.0f} min")
+
+    while queue or running:
+        if not queue:
+            await asyncio.wait(running)
+            continue
+        delay = queue[0][0] - time.time()
+        if delay > 0:
+            # wake up regularly, a finished refresh may have queued an earlier state
+            await asyncio.sleep(min(delay, 60))
+            continue
+        _, state = heapq.heappop(queue)
+        task = asyncio.create_task(refresh(state))
+        running.add(task)
+        task.add_done_callback(running.discard)
+    log.info(f"prewarm: {stats}")
+    return stats
+
+
+async def main(args):
+    states = read_states(args.states_file)
+    cache = ResultCache(path=args.cache_file, max_entries=max(128, len(states)))
+    try:
+        stats = await prewarm(states, cache, args.period, args.min_interval, args.stagger,
+                              concurrency=args.max_in_flight, once=args.once)
+    finally:
+        cache.flush()
+        await attraction_crawl.client.aclose()
+        await attraction_crawl.proxy_client.aclose()
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--states-file", default=STATES_FILE, help="provinces to keep warm")
+    parser.add_argument("--cache-file", default=attraction_crawl.RESULT_CACHE_FILE,
+                        help="result cache shared with the live worker")
+    parser.add_argument("--period", type=float, default=6 * 60 * 60,
+                        help="seconds between two refreshes of a rarely requested province")
+    parser.add_argument("--min-interval", type=float, default=30 * 60,
+                        help="seconds between two refreshes of the most requested provinces")
+    parser.add_argument("--stagger", type=float, default=30 * 60,
+                        help="seconds over which the first refresh of all provinces is spread, ignored with --once")
+    parser.add_argument("--max-in-flight", type=int, default=2,
+                        help="maximum number of provinces crawled at the same time")
+    parser.add_argument("--once", action="store_true", help="refresh every province once and exit")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args)))
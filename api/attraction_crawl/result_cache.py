@@ -0,0 +1,250 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+
+from loguru import logger as log
+
+
+def normalize_state(query: str) -> str:
+    """cache key for a state query: "  da  NANG " and "Da Nang" share one entry"""
+    return " ".join(query.split()).casefold()
+
+
+class ResultCache:
+    """
+    LRU cache of crawl results per state with a TTL, backed by a JSON file so it
+    survives restarts. Expired entries are still served immediately while a
+    background task refreshes them (stale-while-revalidate).
+
+    The file can be shared between processes, e.g. the live worker and the
+    prewarm daemon: it is merged back in whenever another process replaced it,
+    keeping the newest result of every state. Every entry also counts how often
+    its state was requested, which is what prewarm.py schedules by.
+    """
+
+    # hits only bump request counters, they are written at most this often
+    SAVE_INTERVAL = 60
+
+    def __init__(self, path=None, ttl=24 * 60 * 60, max_entries=128):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.refreshing = {}
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0}
+        self.mtime = None
+        self.saved_at = 0
+        self.dirty = False
+        self.load()
+
+    def file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """merge the file into memory, the newer result of a state wins"""
+        if not self.path:
+            return
+        mtime = self.file_mtime()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                entries = json.load(file)
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError:
+            log.warning(f"ignoring corrupt result cache {self.path}")
+            return
+        self.mtime = mtime
+        for key, entry in entries.items():
+            current = self.entries.get(key)
+            if current is None:
+                self.entries[key] = entry
+                continue
+            requests = max(entry.get("requests", 0), current.get("requests", 0))
+            if entry["fetched_at"] > current["fetched_at"]:
+                current["value"] = entry["value"]
+                current["fetched_at"] = entry["fetched_at"]
+            current["requests"] = requests
+        self.evict()
+
+    def reload_if_changed(self):
+        """pick up results another process wrote to the shared file"""
+        if self.path and self.file_mtime() != self.mtime:
+            self.load()
+
+    def save(self):
+        if not self.path:
+            return
+        self.reload_if_changed()
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(self.entries, file, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # the result is in memory either way, never fail a good crawl over the file
+            log.warning(f"could not save result cache {self.path}: {e!r}")
+            # still dirty, try again after SAVE_INTERVAL rather than on every hit
+            self.saved_at = time.time()
+            return
+        self.mtime = self.file_mtime()
+        self.saved_at = time.time()
+        self.dirty = False
+
+    def flush(self):
+        """write request counters that are not saved yet"""
+        if self.dirty:
+            self.save()
+
+    def request_counts(self):
+        return {key: entry.get("requests", 0) for key, entry in self.entries.items()}
+
+    def evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def put(self, key, value):
+        requests = self.entries.get(key, {}).get("requests", 0)
+        self.entries[key] = {"value": value, "fetched_at": time.time(), "requests": requests}
+        self.entries.move_to_end(key)
+        self.evict()
+        self.save()
+
+    async def refresh(self, key, query, loader):
+        self.stats["refreshes"] += 1
+        try:
+            value = await loader(query)
+            if value:
+                self.put(key, value)
+        except Exception as e:
+            # keep serving the stale entry, the next request will try again
+            self.stats["refresh_errors"] += 1
+            log.warning(f"background refresh failed for {query}: {e!r}")
+        finally:
+            self.refreshing.pop(key, None)
+
+    async def get(self, query, loader, miss_loader=None):
+        """
+        return the cached result for query, calling `await loader(query)` on a
+        miss. Empty results are returned but not cached. `miss_loader` replaces
+        loader on a miss only, background refreshes always use loader.
+        """
+        key = normalize_state(query)
+        self.reload_if_changed()
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            entry["requests"] = entry.get("requests", 0) + 1
+            self.dirty = True
+            if time.time() - self.saved_at > self.SAVE_INTERVAL:
+                self.save()
+            if time.time() - entry["fetched_at"] < self.ttl:
+                self.stats["hits"] += 1
+            else:
+                self.stats["stale_hits"] += 1
+                if key not in self.refreshing:
+                    self.refreshing[key] = asyncio.create_task(self.refresh(key, query, loader))
+            return entry["value"]
+
+        self.stats["misses"] += 1
+        value = await (miss_loader or loader)(query)
+        if value:
+            self.put(key, value)
+            self.entries[key]["requests"] += 1
+            self.dirty = True
+        return value
+
+    async def wait_for_refreshes(self):
+        """let pending background refreshes finish, e.g. before a one-shot process exits"""
+        if self.refreshing:
+            await asyncio.gather(*self.refreshing.values(), return_exceptions=True)
+
+    def snapshot(self):
+        return dict(self.stats, entries=len(self.entries), refreshing=len(self.refreshing))
+
+
+class NegativeCache:
+    """
+    states known to be empty or broken, e.g. provinces TripAdvisor has no
+    attractions page for. After `threshold` failed crawls in a row a state is
+    answered without crawling for `ttl` seconds; one good crawl clears it.
+
+    Any string can reach it through the api, so it keeps at most `max_entries`
+    states (least recently failed go first), drops expired ones and only
+    writes the blocked states to the file, when that set changes.
+    """
+
+    def __init__(self, path=None, ttl=6 * 60 * 60, threshold=2, max_entries=1024):
+        self.path = path
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.stats = {"blocked": 0, "added": 0}
+        self.load()
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self.entries = OrderedDict(json.load(file))
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError:
+            log.warning(f"ignoring corrupt negative cache {self.path}")
+        self.prune()
+
+    def prune(self):
+        """forget expired blocks and the least recently failed states over max_entries"""
+        now = time.time()
+        for key in [key for key, entry in self.entries.items() if 0 < entry.get("until", 0) < now]:
+            del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        if not self.path:
+            return
+        blocked = {key: entry for key, entry in self.entries.items() if "until" in entry}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(blocked, file, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def check(self, query):
+        """the reason a state is blocked, None when it should be crawled"""
+        entry = self.entries.get(normalize_state(query))
+        if entry is None or entry.get("until", 0) < time.time():
+            return None
+        self.stats["blocked"] += 1
+        return entry["reason"]
+
+    def record_failure(self, query, reason):
+        key = normalize_state(query)
+        entry = self.entries.setdefault(key, {"failures": 0})
+        self.entries.move_to_end(key)
+        entry["failures"] += 1
+        entry["reason"] = reason
+        self.prune()
+        if entry["failures"] >= self.threshold:
+            entry["until"] = time.time() + self.ttl
+            self.stats["added"] += 1
+            log.warning(f"{query}: negative cached for {self.ttl:.0f}s ({reason})")
+            self.save()
+
+    def record_success(self, query):
+        entry = self.entries.pop(normalize_state(query), None)
+        if entry is not None and "until" in entry:
+            self.save()
+
+    def snapshot(self):
+        now = time.time()
+        blocked = {key: entry["reason"] for key, entry in self.entries.items() if entry.get("until", 0) >= now}
+        return dict(self.stats, states=blocked)
@@ -0,0 +1,146 @@
+import json
+import os
+import sys
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from result_cache import normalize_state
+
+# CRAWL_TIMING_LOG=1 (or --timing-log) writes one raw JSON line per span to stderr,
+# CRAWL_METRICS_FILE=<path> (or --metrics-file) keeps the histograms there
+LOG_SPANS = os.environ.get("CRAWL_TIMING_LOG") == "1"
+METRICS_FILE = os.environ.get("CRAWL_METRICS_FILE")
+
+# upper bounds of the histogram buckets in milliseconds, one more bucket holds the rest
+BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+# a long-lived worker rewrites the metrics file at most this often
+WRITE_INTERVAL = 10
+
+# histograms kept per stage for the most recently seen provinces, queries come from users
+MAX_STATES = 128
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, ms, error=False):
+        self.buckets[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.errors += error
+
+    def quantile(self, q):
+        """upper bound of the bucket holding the q-th quantile"""
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                bound = BUCKETS_MS[index] if index < len(BUCKETS_MS) else self.max
+                return round(min(bound, self.max), 2)
+        return 0
+
+    def snapshot(self):
+        labels = [f"le_{bound}" for bound in BUCKETS_MS] + ["inf"]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total / self.count, 2) if self.count else 0,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "max_ms": round(self.max, 2),
+            "buckets": {label: count for label, count in zip(labels, self.buckets) if count},
+        }
+
+
+class Metrics:
+    """
+    latency histograms per stage, and per stage and province for the
+    max_states provinces seen last
+    """
+
+    def __init__(self, max_states=MAX_STATES):
+        self.max_states = max_states
+        self.stages = {}
+        self.states = {}
+        self.written_at = 0
+
+    def observe(self, stage, ms, state=None, error=False):
+        self.stages.setdefault(stage, Histogram()).observe(ms, error)
+        if state:
+            key = normalize_state(state)
+            states = self.states.setdefault(stage, OrderedDict())
+            states.setdefault(key, Histogram()).observe(ms, error)
+            states.move_to_end(key)
+            if len(states) > self.max_states:
+                states.popitem(last=False)
+
+    def snapshot(self):
+        return {
+            "stages": {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+            "states": {
+                stage: {state: histogram.snapshot() for state, histogram in states.items()}
+                for stage, states in self.states.items()
+            },
+        }
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, path)
+        self.written_at = time.time()
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def span(stage, state=None, **fields):
+    """
+    time the block as `stage` of `state` (a province), e.g.
+
+        with span("fetch", query, url=url):
+            content = await oxylabs.fetch_page(...)
+
+    the yielded dict can take more fields for the log line, like a result count
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        yield fields
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        metrics.observe(stage, ms, state, error is not None)
+        if LOG_SPANS:
+            record = {"span": stage, "state": state, "ms": round(ms, 2), **fields}
+            if error:
+                record["error"] = error
+            # straight to stderr: loguru's format would prefix it and stdout carries the worker protocol
+            print(json.dumps(record, ensure_ascii=False), file=sys.stderr, flush=True)
+
+
+def configure(log_spans=False, metrics_file=None):
+    """command line overrides of CRAWL_TIMING_LOG and CRAWL_METRICS_FILE"""
+    global LOG_SPANS, METRICS_FILE
+    LOG_SPANS = LOG_SPANS or log_spans
+    METRICS_FILE = metrics_file or METRICS_FILE
+
+
+def write_metrics(force=True):
+    """write the histograms to METRICS_FILE, with force=False at most every WRITE_INTERVAL seconds"""
+    if METRICS_FILE and (force or time.time() - metrics.written_at > WRITE_INTERVAL):
+        metrics.write(METRICS_FILE)
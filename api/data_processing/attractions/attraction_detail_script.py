@@ -1,6 +1,20 @@
 from bs4 import BeautifulSoup
+import argparse
+import asyncio
+import hashlib
 import json
-import requests
+import os
+import re
+import sys
+import textwrap
+
+# shared crawl helpers live next to the live recommendation crawler
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'attraction_crawl'))
+import oxylabs
+import page_cache
+import timing
+from crawl_scheduler import CrawlError, CrawlScheduler
+from timing import span
 
 def read_json_file(filename):
     try:
@@ -39,119 +53,387 @@ def split_by_and(input_str):
     parts = input_str.split(" and ")
     return parts
 
-data = read_json_file('attractions.json')
 credentials = ('mingming', 'Gogogogo1234')
 
-attraction_details = []
+# Function to parse the review cards of one review page
+def parse_reviews(content):
+    soup = BeautifulSoup(content, "html.parser")
+    reviews = []
+    for index, div in enumerate(soup.find_all("div", {"class": "_c", "data-automation": "reviewCard"})):
+        cur_review = {}
+
+        username_anchor = div.find("a", {"class": "BMQDV _F Gv wSSLS SwZTJ FGwzt ukgoS"})
+        username = ""
+        if username_anchor:
+            username = username_anchor.get_text(strip=True)
+        cur_review['username'] = username
+
+        rating_title = div.find("title")
+        rating = 0
+        if rating_title:
+            tmp_rating = rating_title.get_text(strip=True)
+            match = re.search(r'\d+(\.\d+)?', tmp_rating)
+            rating = match.group()
+        rating = int(float(rating))
+        cur_review['rating'] = rating
+
+        title_span = div.find("span", {"class": "yCeTE"})
+        title = ""
+        if title_span:
+            title = title_span.get_text(strip=True)
+        cur_review['title'] = title
+
+        time_and_type_div = div.find("div", {"class": "RpeCd"})
+        time_trip = ""
+        go_with = ""
+        if time_and_type_div:
+            (time_trip, go_with) = split_date_and_type(time_and_type_div.get_text(strip=True))
+        cur_review['time'] = time_trip
+        cur_review['type_trip'] = go_with
+
+        content_div = div.find("div", {"class": "biGQs _P pZUbB KxBGd"})
+        content_span = content_div.find("span", {"class": "yCeTE"})
+        content = ""
+        if content_span:
+            content = content_span.get_text(strip=True)
+        cur_review['content'] = content
+        reviews.append(cur_review)
+    return reviews
+
+# TripAdvisor shows 10 reviews per page, we crawl at most 10 pages
+MAX_REVIEW_PAGES = 10
+
+# Function to build the url of the review page starting at review `offset`
+def review_page_url(attraction_link, offset):
+    if offset > 0:
+        attraction_link = transform_url(attraction_link, offset)
+    return "https://www.tripadvisor.com" + attraction_link
+
+# Function to fetch and parse one review page, None when the fetch failed
+async def fetch_review_page(url, proxy_client, scheduler, state=None):
+    print("URL: ", url)
+    try:
+        with span("review_fetch", state, url=url):
+            content = await oxylabs.fetch_page(proxy_client, url, scheduler)
+    except CrawlError:
+        return None
+    with span("review_parse", state) as fields:
+        reviews = parse_reviews(content)
+        fields["reviews"] = len(reviews)
+    return reviews
+
+# Function to identify a review across crawls
+def review_fingerprint(review):
+    content_hash = hashlib.sha1(review['content'].encode('utf-8')).hexdigest()
+    return (review['username'], review['title'], review['time'], content_hash)
 
-for i in range(0, len(data)):
-    print("Attraction ", i + 1)
+# Function to crawl up to 10 review pages of one attraction.
+# The offsets of the pages are known in advance, so up to `prefetch` pages are
+# fetched ahead of the one being read. Pages past the first short or empty
+# page are cancelled and never read.
+# With the attraction's `previous` detail, pagination stops at the first review
+# it already has and the new reviews are put in front of the old ones.
+async def crawl_attraction(attraction, proxy_client, scheduler, prefetch=1, previous=None):
     attraction_detail = {}
-    attraction_detail['name'] = data[i]['name']
-    attraction_detail['image'] = data[i]['image']
-    attraction_detail['state'] = data[i]['state']
-    attraction_detail['rating'] = data[i]['rating']
-    attraction_detail['tag'] = data[i]['tag']
-    attraction_detail['tag_split'] = split_by_and(data[i]['tag'])
+    attraction_detail['name'] = attraction['name']
+    attraction_detail['image'] = attraction['image']
+    attraction_detail['state'] = attraction['state']
+    attraction_detail['rating'] = attraction['rating']
+    attraction_detail['tag'] = attraction['tag']
+    attraction_detail['tag_split'] = split_by_and(attraction['tag'])
 
     reviews = []
     review_score = {'0': 0, '1': 0, '2': 0, '3': 0, '4': 0, '5': 0}
-    
-    review_index = 0
-
-    for page in range(10):
-        attraction_link = data[i]['url']
-        if review_index % 10 != 0:
-            break
-        if review_index > 0:
-            attraction_link = transform_url(attraction_link, review_index)
-        url = "https://www.tripadvisor.com" + attraction_link
-        print("URL: ", url)
-        payload = {
-            'source': 'universal',
-            "geo_location": "United States",
-            'url': url
-        }
-        response = requests.post(
-            'https://realtime.oxylabs.io/v1/queries',
-            auth=credentials,
-            json=payload,
-        )
-        # print("Status code: ", response.status_code)
-        isIncreasePage = False
-        if(response.status_code != 200):
-            break
-        content = response.json()["results"][0]["content"]
-        soup = BeautifulSoup(content, "html.parser")
-
-        for index, div in enumerate(soup.find_all("div", {"class": "_c", "data-automation": "reviewCard"})):
-            review_index += 1
-            isIncreasePage = True
-            cur_review = {}
-
-            username_anchor = div.find("a", {"class": "BMQDV _F Gv wSSLS SwZTJ FGwzt ukgoS"})
-            username = ""
-            if username_anchor:
-                username = username_anchor.get_text(strip=True)
-            cur_review['username'] = username
-
-            rating_title = div.find("title")
-            rating = 0
-            if rating_title:
-                tmp_rating = rating_title.get_text(strip=True)
-                import re
-                match = re.search(r'\d+(\.\d+)?', tmp_rating)
-                rating = match.group()
-            rating = int(float(rating))
-            cur_review['rating'] = rating
-            review_score[f'{rating}'] += 1
-
-            title_span = div.find("span", {"class": "yCeTE"})
-            title = ""
-            if title_span:
-                title = title_span.get_text(strip=True)
-            cur_review['title'] = title
-
-            time_and_type_div = div.find("div", {"class": "RpeCd"})
-            time_trip = ""
-            go_with = ""
-            if time_and_type_div:
-                (time_trip, go_with) = split_date_and_type(time_and_type_div.get_text(strip=True))
-            cur_review['time'] = time_trip
-            cur_review['type_trip'] = go_with
-
-            content_div = div.find("div", {"class": "biGQs _P pZUbB KxBGd"})
-            content_span = content_div.find("span", {"class": "yCeTE"})
-            content = ""
-            if content_span:
-                content = content_span.get_text(strip=True)
-            cur_review['content'] = content
-            reviews.append(cur_review)
-        
-        if isIncreasePage == False:
-            break
+
+    known = set()
+    if previous:
+        known = {review_fingerprint(review) for review in previous['review']}
+    reached_known = False
+
+    pending = {}
+    next_page = 0
+    with span("review_pagination", attraction['state'], name=attraction['name']) as fields:
+        try:
+            for page in range(MAX_REVIEW_PAGES):
+                while next_page < MAX_REVIEW_PAGES and next_page < page + max(1, prefetch):
+                    url = review_page_url(attraction['url'], next_page * 10)
+                    pending[next_page] = asyncio.create_task(
+                        fetch_review_page(url, proxy_client, scheduler, attraction['state']))
+                    next_page += 1
+
+                fields["pages"] = page + 1
+                page_reviews = await pending.pop(page)
+                if page_reviews is None:
+                    break
+                for cur_review in page_reviews:
+                    if review_fingerprint(cur_review) in known:
+                        reached_known = True
+                        break
+                    review_score[f'{cur_review["rating"]}'] += 1
+                    reviews.append(cur_review)
+
+                # an empty or short page is the last one
+                if reached_known or len(page_reviews) == 0 or len(reviews) % 10 != 0:
+                    break
+        finally:
+            for task in pending.values():
+                task.cancel()
+            await asyncio.gather(*pending.values(), return_exceptions=True)
+        fields["reviews"] = len(reviews)
+
+    if previous:
+        print(f"New reviews for {attraction_detail['name']}: ", len(reviews))
+        for review in previous['review']:
+            review_score[f'{review["rating"]}'] += 1
+        reviews = reviews + previous['review']
 
     attraction_detail['num_review'] = len(reviews)
     attraction_detail['review_score'] = review_score
     attraction_detail['review'] = reviews
-    attraction_details.append(attraction_detail)
-    
+
     print(f"Complete crawling review for {attraction_detail['name']}")
     print(f"Num reviews: ", len(reviews))
+    return attraction_detail
 
-def read_json_file(filename):
+# Checkpoint journal: one NDJSON line {"index", "url", "detail"} per crawled attraction,
+# appended as soon as the attraction is done so a crash loses nothing
+def repair_journal(filename):
+    """drop a half-written last line left behind by a crash"""
     try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            return json.load(file)
+        with open(filename, 'rb+') as file:
+            content_end = file.seek(0, os.SEEK_END)
+            if content_end == 0:
+                return
+            file.seek(content_end - 1)
+            if file.read(1) == b"\n":
+                return
+            position = content_end - 1
+            while position > 0:
+                file.seek(position - 1)
+                if file.read(1) == b"\n":
+                    break
+                position -= 1
+            file.truncate(position)
     except FileNotFoundError:
-        return [] 
-    except json.JSONDecodeError:
-        return []
-def append_to_json_file(new_data, filename):
-    data = read_json_file(filename) 
-    for i in new_data:
-        data.append(i)
-    with open(filename, 'w', encoding='utf-8') as file:
-        json.dump(data, file, ensure_ascii=False, indent=4)
-append_to_json_file(attraction_details, 'attraction_detail.json')
-print("JSON file has been created with all states of Vietnam.")
\ No newline at end of file
+        pass
+
+# Function to map (index, url) of every journaled attraction to its line offset.
+# A {"written": true} line marks that the attractions before it are in the output
+# already, with since_written only the attractions after the last one are mapped
+def read_journal(filename, since_written=False):
+    offsets = {}
+    try:
+        with open(filename, 'rb') as file:
+            while True:
+                offset = file.tell()
+                line = file.readline()
+                if not line:
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get('written'):
+                    if since_written:
+                        offsets.clear()
+                    continue
+                offsets[(record['index'], record['url'])] = offset
+    except FileNotFoundError:
+        pass
+    return offsets
+
+# Function to iterate over the items of a JSON array file one at a time,
+# decoding it in chunks so the file is never held in memory as a whole
+def iter_json_array(filename, chunk_size=1 << 16):
+    decoder = json.JSONDecoder()
+    try:
+        file = open(filename, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return
+    with file:
+        buffer = file.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            return
+        buffer = buffer[1:]
+        eof = False
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            yield item
+            buffer = buffer[end:]
+
+def write_detail(file, detail, first):
+    file.write('\n' if first else ',\n')
+    file.write(textwrap.indent(json.dumps(detail, ensure_ascii=False, indent=4), '    '))
+
+# Function to add the journaled attractions to the JSON array in filename, in input order,
+# reading them back one at a time so memory does not grow with the dataset. The array is
+# appended to in place, only its closing bracket is rewritten. With replace the file is
+# streamed into a new one instead, leaving out the attractions the journal has a newer
+# detail of, e.g. for --incremental. Returns the number of attractions added
+def write_json_from_journal(journal, keys, filename, replace=False):
+    offsets = read_journal(journal, since_written=True)
+    keys = [key for key in keys if key in offsets]
+    count = 0
+    with open(journal, 'rb') as source:
+        def details():
+            for key in keys:
+                source.seek(offsets[key])
+                yield json.loads(source.readline())['detail']
+
+        if replace:
+            replaced = {(detail['name'], detail['state']) for detail in details()}
+            tmp_filename = filename + '.tmp'
+            with open(tmp_filename, 'w', encoding='utf-8') as file:
+                file.write('[')
+                for detail in iter_json_array(filename):
+                    if (detail['name'], detail['state']) not in replaced:
+                        write_detail(file, detail, count == 0)
+                        count += 1
+                total = count
+                for detail in details():
+                    write_detail(file, detail, count == 0)
+                    count += 1
+                file.write('\n]' if count else ']')
+            os.replace(tmp_filename, filename)
+            count -= total
+        elif keys:
+            with open(filename, 'a+', encoding='utf-8') as file:
+                pass
+            with open(filename, 'r+b') as file:
+                # find the closing bracket, and whether the array holds anything yet
+                end = file.seek(0, os.SEEK_END)
+                tail = b''
+                while end > 0 and not tail.strip():
+                    start = max(0, end - 4096)
+                    file.seek(start)
+                    tail = file.read(end - start) + tail
+                    end = start
+                tail = tail.rstrip()
+                empty = not tail
+                if tail.endswith(b']'):
+                    tail = tail[:-1].rstrip()
+                    empty = tail.endswith(b'[')
+                file.seek(end + len(tail))
+                file.truncate()
+                if not tail:
+                    file.write(b'[')
+                file.flush()
+                with open(file.fileno(), 'w', encoding='utf-8', closefd=False) as text:
+                    for detail in details():
+                        write_detail(text, detail, empty and count == 0)
+                        count += 1
+                    text.write('\n]')
+    # mark them as written, a later --resume only adds what comes after
+    with open(journal, 'a', encoding='utf-8') as file:
+        file.write(json.dumps({"written": True}) + "\n")
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default='attractions.json')
+    parser.add_argument("--output", default='attraction_detail.json',
+                        help="the crawled attractions are appended to it, with --incremental they replace "
+                             "the earlier details of the same attractions")
+    parser.add_argument("--journal", help="checkpoint journal, defaults to the output name with .ndjson")
+    journal_mode = parser.add_mutually_exclusive_group()
+    journal_mode.add_argument("--resume", action="store_true",
+                              help="keep the journal of a previous run and skip the attractions it already has")
+    journal_mode.add_argument("--fresh", action="store_true",
+                              help="discard the journal of a previous run and crawl everything again")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="number of attractions whose reviews are crawled at the same time")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only crawl reviews newer than the ones in --previous and merge them in")
+    parser.add_argument("--previous", help="attraction details to refresh with --incremental, defaults to --output")
+    parser.add_argument("--prefetch-pages", type=int,
+                        help="review pages of one attraction fetched ahead speculatively, 1 fetches them one by one "
+                             "(default 3, or 1 with --incremental where usually a single page is new)")
+    parser.add_argument("--rate", type=float, default=2.0, help="proxy requests per second")
+    parser.add_argument("--max-retries", type=int, default=4, help="retries per proxy request")
+    parser.add_argument("--replay", action="store_true",
+                        help="re-parse review pages from the page cache without any network call")
+    parser.add_argument("--timing-log", action="store_true", help="log a JSON line with the duration of every stage")
+    parser.add_argument("--metrics-file", help="write latency histograms per stage and per state to this JSON file")
+    args = parser.parse_args()
+    timing.configure(args.timing_log, args.metrics_file)
+    if args.replay:
+        page_cache.enable_replay()
+
+    data = read_json_file(args.input)
+    keys = [(i, data[i]['url']) for i in range(len(data))]
+    journal = args.journal or os.path.splitext(args.output)[0] + '.ndjson'
+    prefetch = args.prefetch_pages or (1 if args.incremental else 3)
+
+    previous = {}
+    if args.incremental:
+        for detail in read_json_file(args.previous or args.output):
+            previous[(detail['name'], detail['state'])] = detail
+        print(f"Refreshing reviews incrementally, {len(previous)} attractions already known")
+
+    if args.resume:
+        repair_journal(journal)
+        done = read_journal(journal)
+    else:
+        # the journal of a crashed run holds hours of proxy requests, never drop it by accident
+        if not args.fresh and os.path.exists(journal) and os.path.getsize(journal) > 0:
+            parser.error(f"{journal} holds a previous run, pass --resume to continue it or --fresh to discard it")
+        open(journal, 'w').close()
+        done = {}
+    todo = [i for i in range(len(data)) if keys[i] not in done]
+    print(f"{len(data) - len(todo)} attractions already crawled, {len(todo)} to go")
+
+    # Crawl many attractions at once over one pooled keep-alive client,
+    # every finished attraction goes straight to the journal
+    async def main():
+        scheduler = CrawlScheduler(rate=args.rate, max_per_host=args.concurrency, max_retries=args.max_retries)
+        proxy_client = oxylabs.make_proxy_client(credentials, max_connections=args.concurrency)
+        completed = len(data) - len(todo)
+
+        with open(journal, 'a', encoding='utf-8') as journal_file:
+            async def crawl(i):
+                nonlocal completed
+                print("Attraction ", i + 1)
+                # kept until the journal has the merged detail, a requeued crawl needs it again
+                previous_detail = previous.get((data[i]['name'], data[i]['state']))
+                detail = await crawl_attraction(data[i], proxy_client, scheduler, prefetch=prefetch,
+                                                previous=previous_detail)
+                record = {"index": i, "url": data[i]['url'], "detail": detail}
+                with span("journal_write", data[i]['state']):
+                    journal_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    journal_file.flush()
+                previous.pop((data[i]['name'], data[i]['state']), None)
+                completed += 1
+                print(f"Progress: {completed}/{len(data)}")
+                return True
+
+            try:
+                _, failed = await scheduler.run_all(todo, crawl, concurrency=args.concurrency)
+            finally:
+                await proxy_client.aclose()
+        for i in failed:
+            print(f"Failed crawling review for {data[i]['name']}")
+        return failed
+
+    failed = asyncio.run(main())
+    with span("write_output") as fields:
+        # an incremental run replaces the details it refreshed
+        count = write_json_from_journal(journal, keys, args.output, replace=args.incremental)
+        fields["attractions"] = count
+    print(f"{count} attractions have been written to {args.output}.")
+    if failed:
+        print(f"Kept {journal}, run again with --resume to retry the {len(failed)} failed attractions.")
+    else:
+        # everything is in the output, the next run starts a new journal
+        os.remove(journal)
+    timing.write_metrics()
@@ -0,0 +1,57 @@
+"""
+reviews scored per second by score_review_script with a growing number of
+worker processes, e.g.
+
+    python bench_score.py final_attraction_detail.json --limit 2000 --workers 1 2 4 8
+
+every run starts its own pool, so model loading is part of the timing like in a
+real run; the scores of every run are checked against the single process run.
+The sentiment cache is turned off, otherwise every run after the first one would
+only measure cache hits
+"""
+import argparse
+import copy
+import os
+import time
+
+# before score_attraction is imported, spawned workers inherit it too
+os.environ["SENTIMENT_CACHE"] = "off"
+
+import score_review_script
+
+
+def scored_reviews(data, limit):
+    """the first attractions of data holding about `limit` reviews"""
+    sample = []
+    count = 0
+    for attraction in data:
+        if count >= limit:
+            break
+        sample.append(attraction)
+        count += len(attraction['review'])
+    return sample, count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="attraction details with reviews, e.g. final_attraction_detail.json")
+    parser.add_argument("--limit", type=int, default=2000, help="approximate number of reviews to score")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    sample, reviews = scored_reviews(score_review_script.read_json_file(args.input), args.limit)
+    print(f"{reviews} reviews of {len(sample)} attractions, {os.cpu_count()} cores")
+    expected = None
+    baseline = None
+    for workers in sorted(set(args.workers)):
+        start = time.perf_counter()
+        scored = score_review_script.score_attractions(copy.deepcopy(sample), workers, args.batch_size)
+        elapsed = time.perf_counter() - start
+        weights = [attraction['weight'] for attraction in scored]
+        expected = expected or weights
+        baseline = baseline or elapsed
+        same = max((abs(a - b) for a, b in zip(weights, expected)), default=0) < 1e-4
+        status = "identical" if same else "DIFFERENT SCORES"
+        print(f"{workers:3d} workers {elapsed:8.2f} s {reviews / elapsed:9.1f} reviews/s  "
+              f"x{baseline / elapsed:4.1f}  {status}")
@@ -1,11 +1,62 @@
-import pandas as pd
-from transformers import pipeline, AutoTokenizer
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
 import numpy as np
 
 # Use a pretrained model to analyze sentiment
 model_name = "distilbert-base-uncased-finetuned-sst-2-english"
-sentiment_model = pipeline("sentiment-analysis", model=model_name)
-tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+# The tokenizer and model are loaded by load_model() on first inference and shared by the
+# whole process, so importing this module for sigmoid() or calculate_weight_improved() is cheap
+tokenizer = None
+model = None
+model_lock = threading.Lock()
+
+# Maximum number of tokens of a title and of a content that are scored
+TITLE_MAX_TOKENS = 128
+CONTENT_MAX_TOKENS = 384
+
+# Number of texts per forward pass of the batched scoring functions
+BATCH_SIZE = 32
+
+# Title and content scores of every review already scored, keyed by a hash of the model
+# name and the truncated title and content tokens. SENTIMENT_CACHE=<file> moves it, e.g.
+# to share one cache between both copies of this module, SENTIMENT_CACHE=off disables it
+SENTIMENT_CACHE = os.environ.get(
+    "SENTIMENT_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "sentiment.sqlite"))
+sentiment_cache = None
+cache_stats = {"hits": 0, "misses": 0}
+
+# Function to load the tokenizer once per process, cached reviews need nothing else
+def load_tokenizer():
+    global tokenizer
+    if tokenizer is None:
+        with model_lock:
+            if tokenizer is None:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return tokenizer
+
+# Function to load the tokenizer and model once per process, torch and transformers included
+def load_model():
+    global model
+    load_tokenizer()
+    if model is None:
+        with model_lock:
+            if model is None:
+                from transformers import AutoModelForSequenceClassification
+                loaded = AutoModelForSequenceClassification.from_pretrained(model_name)
+                loaded.eval()
+                model = loaded
+    return tokenizer, model
+
+# Function to pay the model loading cost up front, e.g. when a service starts
+def warmup():
+    load_model()
+    get_sentiment_scores(["warmup"], TITLE_MAX_TOKENS)
 
 # Sigmoid function to normalize values
 def sigmoid(x):
@@ -33,36 +84,180 @@ def calculate_weight_improved(rating, title_sentiment_score, content_sentiment_s
     # Scale weight to a range of 100
     return weight * 100
 
-# Function to truncate text to fit the model's maximum token length
+# Function to truncate text to fit the model's maximum token length.
+# Only used by legacy_sentiment_scores(), the scoring path truncates while tokenizing
 def truncate_text(text, max_tokens=512):
+    tokenizer = load_tokenizer()
     tokens = tokenizer.tokenize(text)
     if len(tokens) > max_tokens:
         tokens = tokens[:max_tokens]
     return tokenizer.convert_tokens_to_string(tokens)
 
-# Function to get weight of a single comment
-def get_comment_weight(rating, title, content):
-    truncated_title = truncate_text(title, max_tokens=128)
-    truncated_content = truncate_text(content, max_tokens=384)
-    
-    title_sentiment_score = sentiment_model(truncated_title)[0]['score']
-    content_sentiment_score = sentiment_model(truncated_content)[0]['score']
-    
-    weight = calculate_weight_improved(rating, title_sentiment_score, content_sentiment_score)
-    return weight
+# Function to tokenize texts once, truncated to max_tokens plus [CLS] and [SEP]
+def encode_texts(texts, max_tokens):
+    tokenizer = load_tokenizer()
+    encoded = tokenizer(list(texts), truncation=True, max_length=max_tokens + tokenizer.num_special_tokens_to_add())
+    return encoded['input_ids']
 
-# Function to calculate the average weight for a single attraction
-def get_attraction_weight(attraction):
-    comments = attraction['review']
-    weights = []
-    for comment in comments:
-        weight = get_comment_weight(comment['rating'], comment['title'], comment['content'])
-        weights.append(weight)
-    
+# Function to get the sentiment score of many tokenized texts, in batches of texts of similar
+# length. The padded tensors go straight to the model. The score is the one of the
+# sentiment-analysis pipeline: the probability of the predicted label
+def score_token_ids(token_ids, batch_size=BATCH_SIZE):
+    import torch
+    tokenizer, model = load_model()
+    # sorting by length keeps the padding inside a batch small
+    order = sorted(range(len(token_ids)), key=lambda i: len(token_ids[i]))
+    scores = [0.0] * len(token_ids)
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            width = max(len(token_ids[i]) for i in batch)
+            input_ids = torch.full((len(batch), width), tokenizer.pad_token_id, dtype=torch.long)
+            attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+            for row, i in enumerate(batch):
+                input_ids[row, :len(token_ids[i])] = torch.tensor(token_ids[i])
+                attention_mask[row, :len(token_ids[i])] = 1
+            probabilities = model(input_ids=input_ids, attention_mask=attention_mask).logits.softmax(dim=-1)
+            for i, score in zip(batch, probabilities.max(dim=-1).values.tolist()):
+                scores[i] = score
+    return scores
+
+# Function to get the sentiment score of many texts
+def get_sentiment_scores(texts, max_tokens, batch_size=BATCH_SIZE):
+    return score_token_ids(encode_texts(texts, max_tokens), batch_size)
+
+# Function to open the sentiment cache of this process, None when it is disabled
+def get_sentiment_cache():
+    global sentiment_cache
+    if sentiment_cache is None and SENTIMENT_CACHE != "off":
+        os.makedirs(os.path.dirname(SENTIMENT_CACHE) or ".", exist_ok=True)
+        # scoring worker processes share the file, wait for each other's writes
+        sentiment_cache = sqlite3.connect(SENTIMENT_CACHE, timeout=60)
+        sentiment_cache.execute("PRAGMA journal_mode=WAL")
+        sentiment_cache.execute(
+            "CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, title_score REAL NOT NULL, content_score REAL NOT NULL)"
+        )
+        sentiment_cache.commit()
+    return sentiment_cache
+
+# Function to build the cache key of a review from its truncated title and content tokens
+def review_key(title_ids, content_ids):
+    return hashlib.sha256(json.dumps([model_name, title_ids, content_ids]).encode('utf-8')).hexdigest()
+
+# Function to read the cached (title score, content score) of many review keys
+def read_cached_scores(keys):
+    cache = get_sentiment_cache()
+    found = {}
+    if cache is None:
+        return found
+    unique = list(set(keys))
+    # stay below sqlite's limit of host parameters per statement
+    for start in range(0, len(unique), 500):
+        chunk = unique[start:start + 500]
+        rows = cache.execute(
+            f"SELECT key, title_score, content_score FROM scores WHERE key IN ({','.join('?' * len(chunk))})", chunk
+        )
+        for key, title_score, content_score in rows:
+            found[key] = (title_score, content_score)
+    return found
+
+# Function to store the scores of newly scored reviews
+def write_cached_scores(scores):
+    cache = get_sentiment_cache()
+    if cache is None or not scores:
+        return
+    with cache:
+        cache.executemany(
+            "INSERT OR REPLACE INTO scores VALUES (?, ?, ?)",
+            [(key, title_score, content_score) for key, (title_score, content_score) in scores.items()],
+        )
+
+# Function to get the sentiment scores the way they were computed before single-pass
+# tokenization: tokenize, cut, convert back to a string and run the pipeline on it
+def legacy_sentiment_scores(texts, max_tokens):
+    from transformers import pipeline
+    tokenizer, model = load_model()
+    sentiment_model = pipeline("sentiment-analysis", model=model, tokenizer=tokenizer)
+    return [sentiment_model(truncate_text(text, max_tokens=max_tokens))[0]['score'] for text in texts]
+
+# Function to get the weights of many comments at once, e.g. all comments of one
+# attraction or of the whole dataset. Reviews found in the sentiment cache are not
+# run through the model again, only new or changed ones are
+def get_comment_weights(comments, batch_size=BATCH_SIZE):
+    if not comments:
+        return []
+    title_ids = encode_texts([comment['title'] for comment in comments], TITLE_MAX_TOKENS)
+    content_ids = encode_texts([comment['content'] for comment in comments], CONTENT_MAX_TOKENS)
+    keys = [review_key(title, content) for title, content in zip(title_ids, content_ids)]
+
+    scores = read_cached_scores(keys)
+    missing = {}
+    for i, key in enumerate(keys):
+        if key not in scores and key not in missing:
+            missing[key] = i
+    cache_stats["hits"] += len(keys) - len(missing)
+    cache_stats["misses"] += len(missing)
+    if missing:
+        title_scores = score_token_ids([title_ids[i] for i in missing.values()], batch_size)
+        content_scores = score_token_ids([content_ids[i] for i in missing.values()], batch_size)
+        new_scores = dict(zip(missing, zip(title_scores, content_scores)))
+        write_cached_scores(new_scores)
+        scores.update(new_scores)
+
+    return [
+        calculate_weight_improved(comment['rating'], *scores[key])
+        for comment, key in zip(comments, keys)
+    ]
+
+# Function to get the comment weights of every attraction of a dataset in one batched pass
+def get_attractions_comment_weights(attractions, batch_size=BATCH_SIZE):
+    comments = [comment for attraction in attractions for comment in attraction['review']]
+    weights = get_comment_weights(comments, batch_size)
+    per_attraction = []
+    start = 0
+    for attraction in attractions:
+        per_attraction.append(weights[start:start + len(attraction['review'])])
+        start += len(attraction['review'])
+    return per_attraction
+
+# Function to average the comment weights of an attraction
+def average_weight(weights):
     # Check if there are valid weights before calculating the average
     if weights:
-        average_weight = np.mean(weights)
-    else:
-        average_weight = 0  # or any default value you consider appropriate
-    
-    return average_weight
\ No newline at end of file
+        return np.mean(weights)
+    return 0  # or any default value you consider appropriate
+
+# Function to get weight of a single comment, from the sentiment cache when it was scored before
+def get_comment_weight(rating, title, content):
+    return get_comment_weights([{'rating': rating, 'title': title, 'content': content}])[0]
+
+# Function to calculate the average weight for a single attraction
+def get_attraction_weight(attraction, batch_size=BATCH_SIZE):
+    weights = get_comment_weights(attraction['review'], batch_size)
+    return average_weight(weights)
+
+# Function to check that single-pass tokenization gives the scores of the legacy path
+# on the reviews of an attraction detail file, returns the largest difference
+def check_scores(filename, limit=200, tolerance=1e-4):
+    with open(filename, 'r', encoding='utf-8') as file:
+        comments = [comment for attraction in json.load(file) for comment in attraction['review']][:limit]
+    largest = 0.0
+    for field, max_tokens in [('title', TITLE_MAX_TOKENS), ('content', CONTENT_MAX_TOKENS)]:
+        texts = [comment[field] for comment in comments]
+        new_scores = get_sentiment_scores(texts, max_tokens)
+        old_scores = legacy_sentiment_scores(texts, max_tokens)
+        difference = max((abs(new - old) for new, old in zip(new_scores, old_scores)), default=0.0)
+        print(f"{field}: {len(texts)} texts, largest score difference {difference:.2e}")
+        largest = max(largest, difference)
+    print("OK" if largest <= tolerance else "MISMATCH")
+    return largest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--check", metavar="FILE",
+                        help="compare the scores with the legacy tokenize/detokenize path on the reviews of FILE")
+    parser.add_argument("--limit", type=int, default=200, help="number of reviews to check")
+    args = parser.parse_args()
+    if args.check:
+        largest = check_scores(args.check, args.limit)
+        raise SystemExit(0 if largest <= 1e-4 else 1)
@@ -1,42 +1,104 @@
+import argparse
 import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
 import score_attraction
-import numpy as np
 
 def read_json_file(filename):
     try:
         with open(filename, 'r', encoding='utf-8') as file:
             return json.load(file)
     except FileNotFoundError:
-        return [] 
+        return []
     except json.JSONDecodeError:
         return []
 
-data = read_json_file('final_attraction_detail.json')
-# Now `data` holds the JSON data as a Python dictionary
-print(len(data))
-i = 0
-for attraction in data:
-    i += 1
-    comments = attraction['review']
-    weights = []
-    for comment in comments:
-        weight = score_attraction.get_comment_weight(comment['rating'], comment['title'], comment['content'])
-        comment['score'] = weight
-        weights.append(weight)
-    
-    if weights:
-        average_weight = np.mean(weights)
-    else:
-        average_weight = 0
-    
-    attraction['weight'] = average_weight
-    print(f'{i} || {attraction['name']} || Weight: {attraction['weight']}')
-
 def append_to_json_file(new_data, filename):
-    data = read_json_file(filename) 
+    data = read_json_file(filename)
     for i in new_data:
         data.append(i)
     with open(filename, 'w', encoding='utf-8') as file:
         json.dump(data, file, ensure_ascii=False, indent=4)
-append_to_json_file(data, 'score_reviews.json')
-print("JSON file has been created with all states of Vietnam.")
\ No newline at end of file
+
+# Function to score every comment of one attraction and its average weight, in place
+def score_reviews(attraction, batch_size=score_attraction.BATCH_SIZE):
+    comments = attraction['review']
+    # all titles and contents of the attraction go through the model in batches
+    weights = score_attraction.get_comment_weights(comments, batch_size)
+    for comment, weight in zip(comments, weights):
+        comment['score'] = weight
+
+    attraction['weight'] = score_attraction.average_weight(weights)
+    return attraction
+
+# Function run once in every worker process: give it its share of the cores
+# for torch's intra-op threads and load the tokenizer, which every review needs
+# for its cache key. The model is only loaded by the first review the sentiment
+# cache misses, so a fully cached rerun never loads it
+def init_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+    score_attraction.load_tokenizer()
+
+# Function to score a shard of consecutive attractions in a worker process,
+# returns them with the worker's sentiment cache hits and misses for the shard
+def score_shard(shard, batch_size):
+    before = dict(score_attraction.cache_stats)
+    scored = [score_reviews(attraction, batch_size) for attraction in shard]
+    return scored, {key: score_attraction.cache_stats[key] - before[key] for key in before}
+
+# Function to score all attractions, sharded over `workers` processes that each load
+# the model at most once. Results come back in input order; on_scored(i, attraction) is called
+# for every attraction as soon as it is merged
+def score_attractions(data, workers=1, batch_size=score_attraction.BATCH_SIZE, on_scored=None):
+    if workers <= 1:
+        for i, attraction in enumerate(data):
+            score_reviews(attraction, batch_size)
+            if on_scored:
+                on_scored(i, attraction)
+        return data
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # a few shards per worker so a worker with long reviews does not hold up the others
+    shard_size = max(1, len(data) // (workers * 4))
+    shards = [data[start:start + shard_size] for start in range(0, len(data), shard_size)]
+    scored = []
+    # spawn, not fork: a forked torch thread pool can deadlock
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(threads,)) as pool:
+        for shard, shard_stats in pool.map(score_shard, shards, repeat(batch_size)):
+            for key, count in shard_stats.items():
+                score_attraction.cache_stats[key] += count
+            for attraction in shard:
+                if on_scored:
+                    on_scored(len(scored), attraction)
+                scored.append(attraction)
+    return scored
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default='final_attraction_detail.json')
+    parser.add_argument("--output", default='score_reviews.json')
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of scoring processes, each loads the model once (see bench_score.py)")
+    parser.add_argument("--batch-size", type=int, default=score_attraction.BATCH_SIZE,
+                        help="texts per forward pass of the model")
+    args = parser.parse_args()
+
+    data = read_json_file(args.input)
+    # Now `data` holds the JSON data as a Python dictionary
+    print(len(data))
+
+    def print_progress(i, attraction):
+        print(f"{i + 1} || {attraction['name']} || Weight: {attraction['weight']}")
+
+    data = score_attractions(data, args.workers, args.batch_size, on_scored=print_progress)
+
+    stats = score_attraction.cache_stats
+    print(f"Sentiment cache: {stats['hits']} reviews reused, {stats['misses']} scored by the model")
+
+    append_to_json_file(data, args.output)
+    print("JSON file has been created with all states of Vietnam.")
@@ -29,6 +29,10 @@ const Attraction = require('../models/Attraction');
  *                 state:
  *                   type: string
  *                   example: "California"
+ *                 partial:
+ *                   type: boolean
+ *                   description: Set when the crawl hit its deadline and only the attractions parsed so far are returned.
+ *                   example: true
  *                 recommendations:
  *                   type: array
  *                   items:
@@ -74,54 +78,141 @@ async function findAttractionsByState(stateName) {
     }
 }
 
-// Function to handle spawning the Python process and get its output
-async function getRecommendations(state) {
-    return new Promise((resolve, reject) => {
-        const pythonProcess = spawn('python', ['./attraction_crawl/attraction_crawl.py', state]);
+// The route gives up on the worker after ROUTE_TIMEOUT_MS. The worker is told to
+// answer a second earlier, with whatever it has, so that work is not thrown away.
+const ROUTE_TIMEOUT_MS = 10000;
+const CRAWL_DEADLINE_SECONDS = 9;
 
-        let dataBuffer = '';
-        let errorBuffer = '';
-
-        pythonProcess.stdout.on('data', (data) => {
-            dataBuffer += data.toString();
-        });
+// Long-lived Python crawl worker shared by every request. It keeps its HTTP
+// clients warm and answers one JSON line per request, matched by id.
+let crawlWorker = null;
+let nextRequestId = 0;
+const pendingRequests = new Map();
 
-        pythonProcess.stderr.on('data', (data) => {
-            errorBuffer += data.toString();
-        });
+function getCrawlWorker() {
+    if (crawlWorker) {
+        return crawlWorker;
+    }
+    const worker = spawn('python', ['./attraction_crawl/attraction_crawl.py', '--worker']);
+    let dataBuffer = '';
 
-        pythonProcess.on('close', (code) => {
-            if (code !== 0) {
-                return reject(new Error(`Python process exited with code ${code}: ${errorBuffer}`));
+    worker.stdout.on('data', (data) => {
+        dataBuffer += data.toString();
+        let newline;
+        while ((newline = dataBuffer.indexOf('\n')) >= 0) {
+            const line = dataBuffer.slice(0, newline);
+            dataBuffer = dataBuffer.slice(newline + 1);
+            if (!line.trim()) {
+                continue;
             }
+            let response;
             try {
-                const recommendations = JSON.parse(dataBuffer);
-                resolve(recommendations);
+                response = JSON.parse(line);
             } catch (err) {
-                reject(new Error('Failed to parse Python response'));
+                console.error('Failed to parse Python response:', line);
+                continue;
             }
-        });
+            const pending = pendingRequests.get(response.id);
+            if (!pending) {
+                continue;  // caller already timed out
+            }
+            if (response.item) {
+                // streamed attraction, more lines follow until the status line
+                pending.items.push(response.item);
+                continue;
+            }
+            pendingRequests.delete(response.id);
+            if (response.error) {
+                pending.reject(new Error(response.error));
+            } else if (response.status === 'done') {
+                pending.resolve({ recommendations: pending.items, partial: response.partial });
+            } else {
+                pending.resolve({ recommendations: response.recommendations, partial: response.partial });
+            }
+        }
     });
+
+    worker.stderr.on('data', (data) => {
+        console.error(data.toString());
+    });
+
+    const onExit = (reason) => {
+        if (crawlWorker === worker) {
+            crawlWorker = null;
+        }
+        for (const pending of pendingRequests.values()) {
+            pending.reject(new Error(`Python worker exited: ${reason}`));
+        }
+        pendingRequests.clear();
+    };
+    worker.on('close', (code) => onExit(`code ${code}`));
+    worker.on('error', (err) => onExit(err.message));
+
+    crawlWorker = worker;
+    return worker;
+}
+
+// Function to send a state to the Python worker and stream its recommendations.
+// `items` fills up while the worker parses the page, `done` resolves with all of them
+// and whether the worker hit its deadline before the crawl finished.
+function getRecommendations(state) {
+    const id = ++nextRequestId;
+    const items = [];
+    const done = new Promise((resolve, reject) => {
+        pendingRequests.set(id, { resolve, reject, items });
+        const request = { id, state, stream: true, deadline: CRAWL_DEADLINE_SECONDS };
+        getCrawlWorker().stdin.write(JSON.stringify(request) + '\n');
+    });
+    const cancel = () => pendingRequests.delete(id);
+    return { id, items, done, cancel };
+}
+
+function isValidRecommendations(recommendations) {
+    return recommendations.length > 0 && recommendations[0]['image'] !== "";
 }
 
 // GET endpoint to get recommendations for a state
 router.get('/recommendations/:state', async (req, res) => {
     const state = req.params.state;
+    const request = getRecommendations(state);
+    let timer;
     try {
-        const timeoutPromise = new Promise((_, reject) => setTimeout(() => reject(new Error('Python script timeout')), 10000));  // 30-second timeout
-        const recommendations = await Promise.race([getRecommendations(state), timeoutPromise]);
+        const timeoutPromise = new Promise((_, reject) => {
+            timer = setTimeout(() => reject(new Error('Python script timeout')), ROUTE_TIMEOUT_MS);
+        });
+        let recommendations;
+        let partial = false;
+        try {
+            ({ recommendations, partial } = await Promise.race([request.done, timeoutPromise]));
+        } catch (error) {
+            // the attractions streamed before the timeout beat the MongoDB backup
+            if (error.message !== 'Python script timeout' || !isValidRecommendations(request.items)) {
+                throw error;
+            }
+            request.cancel();
+            return res.status(200).json({
+                success: true,
+                state: state,
+                partial: true,
+                recommendations: request.items.slice()
+            });
+        } finally {
+            clearTimeout(timer);
+        }
 
         // Check if recommendations are valid
-        if (recommendations.length > 0 && recommendations[0]['image'] !== "") {
+        if (isValidRecommendations(recommendations)) {
             res.status(200).json({
                 success: true,
                 state: state,
+                ...(partial && { partial: true }),
                 recommendations: recommendations
             });
         } else {
             throw new Error('Invalid recommendations Image data');
         }
     } catch (error) {
+        request.cancel();
         console.error('Python script failed or timed out, fetching data from MongoDB:', error);
         try {
             // If python process is unsuccessful, collect backup data in database